@@ -0,0 +1,66 @@
+# Writes per second through RoutedDatabase with 1, 10 and 100 concurrent clients, each inserting posts one at
+# a time like create_post, with and without group commit (DB_GROUP_COMMIT). Uses the SQLite profile from the
+# config on a fresh file, once with synchronous=NORMAL (the default profile) and once with FULL, where every
+# commit waits for an fsync.
+#
+# Run with: python -m benchmarks.group_commit
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("ENV_STATE", "test")
+
+from storeapi.config import config  # noqa: E402
+from storeapi.database import ProfiledConnection, ReadOnlyConnection  # noqa: E402
+from storeapi.db_routing import RoutedDatabase  # noqa: E402
+
+SECONDS = 2
+CLIENTS = [1, 10, 100]
+
+
+class FullSyncConnection(ProfiledConnection):
+    pragmas = [*ProfiledConnection.pragmas, "PRAGMA synchronous=FULL"]
+
+
+async def run(clients: int, group_commit_window: float, factory) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        database = RoutedDatabase(
+            f"sqlite:///{os.path.join(directory, 'benchmark.db')}",
+            read_pool_size=1,
+            read_options={"factory": ReadOnlyConnection},
+            group_commit_window=group_commit_window,
+            group_commit_max_size=config.DB_GROUP_COMMIT_MAX_SIZE,
+            factory=factory,
+        )
+        await database.connect()
+        await database.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, body TEXT NOT NULL, user_id INTEGER)")
+        writes = 0
+        deadline = time.monotonic() + SECONDS
+
+        async def client():
+            nonlocal writes
+            while time.monotonic() < deadline:
+                await database.execute("INSERT INTO posts (body, user_id) VALUES ('A post', 1)")
+                writes += 1
+
+        start = time.monotonic()
+        await asyncio.gather(*[client() for _ in range(clients)])
+        elapsed = time.monotonic() - start
+        await database.disconnect()
+    return writes / elapsed
+
+
+async def main():
+    for synchronous, factory in (("NORMAL", ProfiledConnection), ("FULL", FullSyncConnection)):
+        for clients in CLIENTS:
+            autocommit = await run(clients, 0, factory)
+            grouped = await run(clients, config.DB_GROUP_COMMIT_WINDOW, factory)
+            print(
+                f"synchronous={synchronous:<6} {clients:3} clients: autocommit {autocommit:7.0f} writes/s,"
+                f" group commit {grouped:7.0f} writes/s ({grouped / autocommit:.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
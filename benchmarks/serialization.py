@@ -0,0 +1,47 @@
+# Compares the two ways of turning database rows into a JSON response body:
+#   response_model - what FastAPI does with a response_model: validate every row into the model, then dump it
+#   fast path      - storeapi.serialization: copy the model's fields out of each row and dump them directly
+#
+# Run with: python -m benchmarks.serialization
+import timeit
+
+from pydantic import TypeAdapter
+
+from storeapi.models.post import Comment, UserPostWithLikes
+from storeapi.serialization import dump_json, rows_to_dicts
+
+ROWS = 10_000
+REPEAT = 20
+
+
+def make_rows(model) -> list[dict]:
+    if model is UserPostWithLikes:
+        return [
+            {"id": i, "body": f"Post number {i}", "user_id": i % 50, "image_url": None, "likes": i % 7}
+            for i in range(ROWS)
+        ]
+    return [{"id": i, "body": f"Comment number {i}", "post_id": i % 100, "user_id": i % 50} for i in range(ROWS)]
+
+
+def main():
+    for model in (UserPostWithLikes, Comment):
+        rows = make_rows(model)
+        adapter = TypeAdapter(list[model])
+
+        def response_model_path():
+            return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+        def fast_path():
+            return dump_json(rows_to_dicts(rows, model))
+
+        assert response_model_path() == fast_path()
+        slow = min(timeit.repeat(response_model_path, number=1, repeat=REPEAT))
+        fast = min(timeit.repeat(fast_path, number=1, repeat=REPEAT))
+        print(
+            f"{model.__name__:<18} {ROWS} rows: response_model {slow * 1000:7.2f} ms,"
+            f" fast path {fast * 1000:7.2f} ms ({slow / fast:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
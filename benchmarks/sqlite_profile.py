@@ -0,0 +1,71 @@
+# Writes and reads at the same time against a fresh SQLite file, once with SQLite's defaults and once with the
+# performance profile from the config (storeapi.database.ProfiledConnection). One writer thread inserts posts,
+# one commit per post like create_post, while reader threads page through the newest posts like GET /post.
+#
+# Run with: python -m benchmarks.sqlite_profile
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("ENV_STATE", "test")
+
+from storeapi.database import ProfiledConnection  # noqa: E402
+
+SECONDS = 3
+READERS = 4
+
+
+class DefaultConnection(ProfiledConnection):
+    # SQLite's defaults, except for a busy timeout so readers wait for locks instead of failing right away
+    pragmas = ["PRAGMA busy_timeout=5000"]
+
+
+def run(factory) -> dict:
+    counts = {"writes": 0, "reads": 0, "locked": 0}
+    lock = threading.Lock()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.db")
+        with sqlite3.connect(path, factory=factory) as connection:
+            connection.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, body TEXT NOT NULL, user_id INTEGER)")
+        stop = threading.Event()
+
+        def worker(kind: str, sql: str, parameters: tuple):
+            connection = sqlite3.connect(path, factory=factory, isolation_level=None)
+            done = locked = 0
+            while not stop.is_set():
+                try:
+                    connection.execute(sql, parameters).fetchall()
+                    done += 1
+                except sqlite3.OperationalError:
+                    locked += 1
+            connection.close()
+            with lock:
+                counts[kind] += done
+                counts["locked"] += locked
+
+        write = ("writes", "INSERT INTO posts (body, user_id) VALUES (?, ?)", ("A post", 1))
+        read = ("reads", "SELECT * FROM posts ORDER BY id DESC LIMIT 21", ())
+        threads = [threading.Thread(target=worker, args=write)]
+        threads += [threading.Thread(target=worker, args=read) for _ in range(READERS)]
+        for thread in threads:
+            thread.start()
+        time.sleep(SECONDS)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return {name: count / SECONDS for name, count in counts.items()}
+
+
+def main():
+    for name, factory in (("defaults", DefaultConnection), ("profile", ProfiledConnection)):
+        result = run(factory)
+        print(
+            f"{name:<9} 1 writer + {READERS} readers: {result['writes']:8.0f} writes/s,"
+            f" {result['reads']:8.0f} reads/s, {result['locked']:5.0f} locked errors/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
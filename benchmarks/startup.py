@@ -0,0 +1,64 @@
+# Startup time: how long a fresh worker takes from launching Python to answering its first request. Each run is a
+# new interpreter, so nothing is imported yet, split up into importing storeapi.main, running the lifespan
+# startup (password hashing calibration, schema setup, connecting) and the first GET /post.
+#
+# Runs against a new database in a temporary directory. Run with: python -m benchmarks.startup
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 5
+
+# Runs in the fresh interpreter and prints the time each step took as JSON, after whatever the app logs
+worker = """
+import asyncio, json, os, time
+start = time.perf_counter()
+from httpx import ASGITransport, AsyncClient
+from storeapi.main import app
+imported = time.perf_counter()
+
+
+async def main():
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        async with AsyncClient(transport=ASGITransport(app), base_url="http://test") as client:
+            response = await client.get("/post")
+            assert response.status_code == 200
+        return started, time.perf_counter()
+
+
+started, responded = asyncio.run(main())
+print("timings", json.dumps({"import": imported - start, "lifespan": started - imported, "first_request": responded - started}), flush=True)
+# The logtail handler's flush thread keeps the interpreter from exiting
+os._exit(0)
+"""
+
+
+def run(database_url: str) -> dict:
+    env = {**os.environ, "ENV_STATE": "test", "TEST_DATABASE_URL": database_url}
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", worker], env=env, capture_output=True, text=True, check=True)
+    line = next(line for line in output.stdout.splitlines() if line.startswith("timings "))
+    timings = json.loads(line.removeprefix("timings "))
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+        # The first run creates the schema, every run after that starts against an existing database
+        first = run(database_url)
+        runs = [run(database_url) for _ in range(RUNS)]
+    print(f"First start (creates the schema): {first['total'] * 1000:6.0f} ms to first response")
+    print(f"Median of {RUNS} starts against an existing database:")
+    for step in ("import", "lifespan", "first_request", "total"):
+        print(f"  {step:<14} {statistics.median(r[step] for r in runs) * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
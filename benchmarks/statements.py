@@ -0,0 +1,60 @@
+# Compares what it costs to turn a feed query into SQL and parameters the way databases does on every execute:
+#   build + compile - build the SQLAlchemy query for the request, then compile it
+#   statement       - bind the values to the prepared Statement, which reuses its cached compilation
+#
+# Run with: python -m benchmarks.statements
+import timeit
+
+import sqlalchemy
+from sqlalchemy.dialects.sqlite import pysqlite
+
+from storeapi.database import post_table
+from storeapi.routers.post import PostSorting, build_feed_query, select_post_and_likes
+
+NUMBER = 1000
+REPEAT = 5
+
+# The dialect databases compiles with for sqlite:// URLs
+dialect = pysqlite.dialect(paramstyle="qmark")
+
+
+def compile_query(query):
+    compiled = query.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    return compiled.string, [params[key] for key in compiled.positiontup]
+
+
+def build_most_likes_query(limit: int, after: dict):
+    return (
+        select_post_and_likes
+        .order_by(post_table.c.like_count.desc(), post_table.c.id.desc())
+        .where(
+            sqlalchemy.or_(
+                post_table.c.like_count < after["likes"],
+                sqlalchemy.and_(post_table.c.like_count == after["likes"], post_table.c.id < after["id"]),
+            )
+        )
+        .limit(limit + 1)
+    )
+
+
+def main():
+    after = {"id": 500, "likes": 3}
+
+    def build_and_compile():
+        return compile_query(build_most_likes_query(20, after))
+
+    def statement():
+        return compile_query(build_feed_query(PostSorting.most_likes, 20, after))
+
+    assert build_and_compile() == statement()
+    slow = min(timeit.repeat(build_and_compile, number=NUMBER, repeat=REPEAT)) / NUMBER
+    fast = min(timeit.repeat(statement, number=NUMBER, repeat=REPEAT)) / NUMBER
+    print(
+        f"most_likes feed page: build + compile {slow * 1e6:7.1f} us,"
+        f" statement {fast * 1e6:7.1f} us ({slow / fast:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
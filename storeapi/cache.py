@@ -0,0 +1,134 @@
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, NamedTuple, Optional
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    expires_at: float
+    size: int
+    tags: tuple
+
+
+# Least-recently-used cache where every entry also expires after a TTL. Entries have a size (1 by default, or
+# e.g. the number of bytes in a cached response) and the least recently used entries are evicted once the
+# total size goes over max_size. Entries can be tagged so that related entries can be invalidated together.
+class LRUCache:
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._tags: dict[Hashable, set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= self.clock():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def set(
+            self,
+            key: Hashable,
+            value: Any,
+            size: int = 1,
+            ttl: Optional[float] = None,
+            tags: Iterable[Hashable] = (),
+    ) -> None:
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_size:
+            return
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        entry = CacheEntry(value, expires_at, size, tuple(tags))
+        self._entries[key] = entry
+        self.size += size
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while self.size > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def invalidate_tag(self, tag: Hashable) -> None:
+        for key in self._tags.pop(tag, set()):
+            self.invalidate(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+# Version counters used to build ETags. Versions only ever go up for a key: keys are evicted once there are
+# more than max_entries, and unknown keys report `base`, which is raised past the version of every evicted key.
+# The epoch changes every time the process starts so ETags handed out by a previous process never match.
+class VersionMap:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.epoch = secrets.token_hex(4)
+        self.base = 0
+        self._versions: OrderedDict[Hashable, int] = OrderedDict()
+
+    def get(self, key: Hashable) -> int:
+        return self._versions.get(key, self.base)
+
+    def bump(self, key: Hashable) -> int:
+        version = self.get(key) + 1
+        self._versions[key] = version
+        self._versions.move_to_end(key)
+        while len(self._versions) > self.max_entries:
+            _, evicted = self._versions.popitem(last=False)
+            self.base = max(self.base, evicted + 1)
+        return version
+
+    def etag(self, key: Hashable) -> str:
+        return f'"{self.epoch}-{key}-{self.get(key)}"'
+
+    def clear(self) -> None:
+        self.epoch = secrets.token_hex(4)
+        self.base = 0
+        self._versions.clear()
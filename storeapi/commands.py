@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+from storeapi.database import database, init_db, reconcile_like_counts, rebuild_post_search
+
+
+# Management commands, run with: python -m storeapi.commands <command>
+async def migrate_database():
+    init_db()
+    print("Database schema is up to date")
+
+
+async def reconcile_likes():
+    # Migrating first adds like_count to a database from before it existed
+    init_db()
+    await database.connect()
+    try:
+        drifted = await reconcile_like_counts()
+    finally:
+        await database.disconnect()
+    print(f"Reconciled like_count on {drifted} posts")
+
+
+async def rebuild_search():
+    # Migrating first creates the search index on a database from before it existed
+    init_db()
+    await database.connect()
+    try:
+        await rebuild_post_search()
+    finally:
+        await database.disconnect()
+    print("Rebuilt the post search index")
+
+
+commands = {
+    "migrate": (migrate_database, "Create missing tables, columns and indexes"),
+    "reconcile-likes": (reconcile_likes, "Recompute posts.like_count from the likes table"),
+    "rebuild-search": (rebuild_search, "Rebuild the full-text search index over post bodies"),
+}
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m storeapi.commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text) in commands.items():
+        subparsers.add_parser(name, help=help_text)
+    args = parser.parse_args(argv)
+    command, _ = commands[args.command]
+    asyncio.run(command())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from typing import Optional
+import os
+from typing import Literal, Optional
 from functools import lru_cache
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -14,12 +15,54 @@ class BaseConfig(BaseSettings):
 class GlobalConfig(BaseConfig):
     DATABASE_URL: Optional[str] = None  # Database connection URL
     DB_FORCE_ROLL_BACK: bool = False  # Flag for rolling back database transactions
+    # SQLite only: reads go to this many shared read-only connections and writes are queued for one writer
+    # connection. 0 sends everything through a single databases.Database. Not used with DB_FORCE_ROLL_BACK.
+    DB_READ_POOL_SIZE: int = 4
+    DB_GROUP_COMMIT: bool = False  # Commit single-statement writes that arrive together in one transaction...
+    DB_GROUP_COMMIT_WINDOW: float = 0.002  # ...collecting them for up to this many seconds...
+    DB_GROUP_COMMIT_MAX_SIZE: int = 100  # ...and at most this many at once. Needs DB_READ_POOL_SIZE > 0.
+    # SQLite settings applied to every connection, see https://www.sqlite.org/pragma.html
+    # WAL lets readers carry on while a write is in progress
+    SQLITE_JOURNAL_MODE: Literal["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"] = "WAL"
+    # NORMAL with WAL only fsyncs at checkpoints: a power loss can lose the last commits but never corrupts
+    SQLITE_SYNCHRONOUS: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024  # Bytes of the database file read through memory mapping
+    SQLITE_CACHE_SIZE: int = -64_000  # Page cache per connection, in pages or in KiB when negative
+    SQLITE_TEMP_STORE: Literal["DEFAULT", "FILE", "MEMORY"] = "MEMORY"  # Where temporary tables and indexes live
+    SQLITE_BUSY_TIMEOUT: int = 5000  # Milliseconds to wait for a lock before failing with "database is locked"
     LOGTAIL_API_KEY: Optional[str] = None
     MAILGUN_API_KEY: Optional[str] = None
     MAILGUN_DOMAIN: Optional[str] = None
     B2_KEY_ID: Optional[str] = None
     B2_APPLICATION_KEY: Optional[str] = None
     B2_BUCKET_NAME: Optional[str] = None
+    B2_UPLOAD_WORKERS: int = 4  # Uploads to B2 that run at once, the others wait their turn
+    B2_UPLOAD_TIMEOUT: float = 600.0  # Seconds a whole upload to B2 may take before a 504
+    B2_UPLOAD_STREAMING: bool = True  # Send uploads to B2 as they are read instead of saving them to a file first
+    B2_UPLOAD_PART_SIZE: int = 8 * 1024 * 1024  # Bytes per part of a streamed upload, B2 needs at least 5 MB
+    B2_UPLOAD_PARTS_IN_FLIGHT: int = 4  # Parts of one streamed upload that are sent at once
+    RESPONSE_CACHE_MAX_BYTES: int = 32 * 1024 * 1024  # Total size of cached feed and post responses
+    RESPONSE_CACHE_TTL: float = 30.0  # Seconds before a cached response is rebuilt even without writes
+    POST_RANKING_SIZE: int = 1000  # How many of the most liked posts to keep in memory for sorting=most_likes
+    BULK_MAX_ITEMS: int = 1000  # Largest batch accepted by the bulk write endpoints
+    LIKE_BUFFER_ENABLED: bool = False  # Acknowledge likes right away and write them in batches
+    LIKE_BUFFER_MAX_SIZE: int = 500  # Write the buffered likes once this many are waiting...
+    LIKE_BUFFER_MAX_DELAY: float = 0.5  # ...or once the oldest has waited this many seconds
+    USER_CACHE_MAX_ENTRIES: int = 10_000  # Users kept in memory for authenticated requests
+    USER_CACHE_TTL: float = 60.0  # Seconds before a cached user is read from the database again
+    TOKEN_CACHE_MAX_ENTRIES: int = 10_000  # Verified tokens kept in memory, each until the token expires
+    PASSWORD_HASH_WORKERS: int = min(4, os.cpu_count() or 1)  # Threads that hash and verify passwords
+    BCRYPT_TARGET_SECONDS: float = 0.3  # At startup bcrypt rounds are picked so that a hash takes about this long...
+    # ...but never fewer rounds than this (passlib's default, what stored hashes use). The floor wins over the target:
+    # where 12 rounds take longer than the target, hashes use 12 rounds anyway and startup logs a warning...
+    BCRYPT_MIN_ROUNDS: int = 12
+    BCRYPT_MAX_ROUNDS: int = 16  # ...or more than this
+    AUTH_MAX_PENDING: int = 64  # /token and /register get a 503 while this many password checks are waiting
+    AUTH_IP_RATE: float = 1.0  # /token and /register requests per second per client IP...
+    AUTH_IP_BURST: int = 20  # ...after a burst of this many
+    AUTH_EMAIL_RATE: float = 0.1  # /token and /register requests per second per email...
+    AUTH_EMAIL_BURST: int = 10  # ...after a burst of this many
+    RATE_LIMIT_MAX_KEYS: int = 100_000  # IPs and emails tracked by each rate limiter
 
 
 # Development configuration class inheriting from GlobalConfig
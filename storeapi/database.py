@@ -1,6 +1,12 @@
-import databases
+import importlib
+import logging
+import sqlite3
 import sqlalchemy
+from storeapi import metrics
 from storeapi.config import config
+from storeapi.db_routing import RoutedDatabase
+
+logger = logging.getLogger(__name__)
 
 # Define SQLAlchemy metadata instance to hold table definitions
 metadata = sqlalchemy.MetaData()
@@ -13,6 +19,14 @@ post_table = sqlalchemy.Table(
     sqlalchemy.Column("body", sqlalchemy.String),  # Body column for post content
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
     sqlalchemy.Column("image_url", sqlalchemy.String),
+    # Number of likes on the post, kept in sync by like_post so reads don't have to count the likes table
+    sqlalchemy.Column("like_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+    # Serves the most_likes feed in order. SQLite appends the rowid (posts.id) to every index, which gives us
+    # the id tiebreaker for free.
+    sqlalchemy.Index("ix_posts_like_count", "like_count"),
+    # Bumped in the same transaction as every comment or like on the post. It is the post's ETag version, kept in
+    # the database so that every worker sees the writes of the others.
+    sqlalchemy.Column("version", sqlalchemy.Integer, nullable=False, server_default="0"),
 )
 
 
@@ -32,7 +46,7 @@ comment_table = sqlalchemy.Table(
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),  # Primary key column
     sqlalchemy.Column("body", sqlalchemy.String),  # Body column for comment content
-    sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),   # Foreign key referencing posts table
+    sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False, index=True),   # Foreign key referencing posts table
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
 )
 
@@ -41,20 +55,211 @@ like_table = sqlalchemy.Table(
     "likes",
     metadata,
  sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),  # Primary key column
-    sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),   # Foreign key referencing posts table
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False, index=True),   # Foreign key referencing posts table
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, index=True)
+)
+
+
+# SQLite FTS5 full-text index over posts.body. It is an external content table: it stores only the index and
+# reads the text from posts, and the triggers below keep it in sync with every write to posts. It isn't part of
+# `metadata` because SQLAlchemy can't create virtual tables; this is just enough of it to write queries against.
+post_search_table = sqlalchemy.table(
+    "posts_fts",
+    sqlalchemy.column("rowid", sqlalchemy.Integer),
+    sqlalchemy.column("body", sqlalchemy.String),
 )
 
+post_search_ddl = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(body, content='posts', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END""",
+    # Only changes to the body touch the index, so like_count updates stay cheap
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF body ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO posts_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+]
+
+# Rebuilds the whole search index from the posts table
+rebuild_post_search_query = sqlalchemy.text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+
+
+def create_post_search(connection) -> bool:
+    # Returns True if the index was just created and still has to be filled with rebuild_post_search_query
+    if connection.dialect.name != "sqlite":
+        return False
+    exists = sqlalchemy.inspect(connection).has_table("posts_fts")
+    for statement in post_search_ddl:
+        connection.execute(sqlalchemy.text(statement))
+    return not exists
+
+
+def sqlite_pragmas() -> list[str]:
+    # The performance profile from the config, as PRAGMA statements
+    return [
+        f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}",
+        f"PRAGMA cache_size={int(config.SQLITE_CACHE_SIZE)}",
+        f"PRAGMA temp_store={config.SQLITE_TEMP_STORE}",
+        f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT)}",
+        # Not a setting: the routers rely on it to reject rows that point at a post or user that doesn't exist
+        "PRAGMA foreign_keys=ON",
+    ]
+
+
+# Most PRAGMAs only last as long as the connection, and databases opens a new connection every time it needs one.
+# So both databases and the engine create their connections with this class, which applies the profile as soon
+# as the connection is open.
+class ProfiledConnection(sqlite3.Connection):
+    pragmas = sqlite_pragmas()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for pragma in self.pragmas:
+            self.execute(pragma).close()
+
+
+class ReadOnlyConnection(ProfiledConnection):
+    pragmas = [*ProfiledConnection.pragmas, "PRAGMA query_only=ON"]
+
+
+is_sqlite = config.DATABASE_URL.startswith("sqlite")
+
+# What the drivers raise when a write breaks a constraint (unique, foreign key, not null). Routers catch this rather
+# than one driver's exception, so they answer the same whatever DATABASE_URL points at.
+def driver_integrity_errors() -> tuple[type[Exception], ...]:
+    errors = [sqlite3.IntegrityError]
+    if not is_sqlite:
+        # Only the driver databases uses for DATABASE_URL is installed, the others are skipped
+        for driver, error in [
+            ("asyncpg", "IntegrityConstraintViolationError"),
+            ("psycopg2", "IntegrityError"),
+            ("pymysql", "IntegrityError"),
+            ("MySQLdb", "IntegrityError"),
+        ]:
+            try:
+                errors.append(getattr(importlib.import_module(driver), error))
+            except ImportError:
+                pass
+    return tuple(errors)
+
+
+integrity_errors = driver_integrity_errors()
+sqlite_options = {"factory": ProfiledConnection} if is_sqlite else {}
 
 # Create an SQLAlchemy engine using the database URL from the configuration
 engine = sqlalchemy.create_engine(
-    config.DATABASE_URL, connect_args={"check_same_thread": False}  # Only relevant for SQLite
+    config.DATABASE_URL,
+    connect_args={"check_same_thread": False, **sqlite_options} if is_sqlite else {},
+)
+
+# Sets like_count on every post whose counter has drifted from the actual number of rows in the likes table
+like_count_drifted = post_table.c.like_count != (
+    sqlalchemy.select(sqlalchemy.func.count(like_table.c.id))
+    .where(like_table.c.post_id == post_table.c.id)
+    .scalar_subquery()
 )
+reconcile_like_counts_query = (
+    post_table.update()
+    .where(like_count_drifted)
+    .values(
+        like_count=sqlalchemy.select(sqlalchemy.func.count(like_table.c.id))
+        .where(like_table.c.post_id == post_table.c.id)
+        .scalar_subquery()
+    )
+)
+
+
+def add_missing_columns(connection) -> list[str]:
+    # create_all only creates tables that don't exist yet, so columns added to an existing table have to be
+    # added by hand. Returns the "table.column" names that were added.
+    inspector = sqlalchemy.inspect(connection)
+    added = []
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_ddl = sqlalchemy.schema.CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_missing_indexes(connection) -> list[str]:
+    # Like columns, indexes declared on a table that already exists aren't created by create_all.
+    # Returns the names of the indexes that were created.
+    inspector = sqlalchemy.inspect(connection)
+    created = []
+    for table in metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                created.append(index.name)
+    return created
+
+
+def migrate(connection) -> None:
+    # Brings an existing database up to date with the tables declared above
+    metadata.create_all(connection)
+    if "posts.like_count" in add_missing_columns(connection):
+        # Backfill the counter the first time it is added to an existing database
+        connection.execute(reconcile_like_counts_query)
+    for index_name in create_missing_indexes(connection):
+        logger.info(f"Created missing index {index_name}")
+    if create_post_search(connection):
+        # Index the posts that were written before the search index existed
+        connection.execute(rebuild_post_search_query)
 
-# Create all tables in the database using the metadata
-metadata.create_all(engine)
 
-# Create a databases.Database instance for database interactions
-database = databases.Database(
-    config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK  # Rollback changes if DB_FORCE_ROLL_BACK is True
+# Creates the tables and brings the schema up to date. It isn't done on import, so importing the app (in a
+# worker, a command or a test) doesn't touch the database; the lifespan calls it once before the app connects.
+def init_db() -> None:
+    with engine.begin() as connection:
+        migrate(connection)
+
+# Create a databases.Database instance for database interactions. With SQLite, reads and writes are routed to
+# separate connections (see db_routing.py); the one connection used by DB_FORCE_ROLL_BACK can't be split up.
+database = RoutedDatabase(
+    config.DATABASE_URL,
+    read_pool_size=config.DB_READ_POOL_SIZE if is_sqlite and not config.DB_FORCE_ROLL_BACK else 0,
+    read_options={"factory": ReadOnlyConnection},
+    group_commit_window=config.DB_GROUP_COMMIT_WINDOW if config.DB_GROUP_COMMIT else 0,
+    group_commit_max_size=config.DB_GROUP_COMMIT_MAX_SIZE,
+    force_rollback=config.DB_FORCE_ROLL_BACK,  # Rollback changes if DB_FORCE_ROLL_BACK is True
+    **sqlite_options,
 )
+metrics.register("database", database.stats)
+
+
+async def reconcile_like_counts() -> int:
+    # Returns how many posts had a like_count that didn't match the likes table
+    query = sqlalchemy.select(sqlalchemy.func.count()).select_from(post_table).where(like_count_drifted)
+    drifted = await database.fetch_val(query)
+    if drifted:
+        await database.execute(reconcile_like_counts_query)
+    return drifted
+
+
+async def rebuild_post_search() -> None:
+    await database.execute(rebuild_post_search_query)
+
+
+async def execute_many(query, values: list[dict]) -> None:
+    # databases' own execute_many runs one execute per row. This compiles the statement once and hands every row
+    # to the driver's executemany. Run it inside database.transaction() to write all rows in one commit.
+    compiled = query.compile(dialect=engine.dialect, column_keys=list(values[0]))
+    # Values that are part of the statement itself, like the 1 in `version + 1`, are the same for every row
+    fixed = compiled.params
+    parameters = [[row[key] if key in row else fixed[key] for key in compiled.positiontup] for row in values]
+
+    async def write(connection):
+        await connection.raw_connection.executemany(str(compiled), parameters)
+
+    await database.write(write)
@@ -0,0 +1,387 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, NamedTuple, Optional
+
+import databases
+from databases.core import Connection
+
+logger = logging.getLogger(__name__)
+
+# The writer connection while the current task holds it, e.g. inside database.transaction()
+current_writer: contextvars.ContextVar[Optional[Connection]] = contextvars.ContextVar("current_writer", default=None)
+
+
+class WaitStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_wait_seconds": self.total / self.count if self.count else 0.0,
+            "max_wait_seconds": self.max,
+        }
+
+
+# Connections that are opened once and shared by the requests that only read. With WAL they read alongside the
+# writer without ever taking its lock. Reads that may hold a connection for a long time, like an export streamed
+# to a slow client, get a connection of their own instead, so they can't leave the quick reads waiting.
+class ReadPool:
+    def __init__(self, database: databases.Database, size: int):
+        self.database = database
+        self.size = size
+        self.waits = WaitStats()
+        self.dedicated = 0
+        self._connections: list[Connection] = []
+        self._available: asyncio.Queue[Connection] = asyncio.Queue()
+
+    async def open(self) -> None:
+        await self.database.connect()
+        for _ in range(self.size):
+            connection = Connection(self.database, self.database._backend)
+            await connection.__aenter__()
+            self._connections.append(connection)
+            self._available.put_nowait(connection)
+
+    async def close(self) -> None:
+        for connection in self._connections:
+            await connection.__aexit__()
+        self._connections.clear()
+        self._available = asyncio.Queue()
+        await self.database.disconnect()
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator[Connection]:
+        start = time.monotonic()
+        connection = await self._available.get()
+        self.waits.record(time.monotonic() - start)
+        try:
+            yield connection
+        finally:
+            self._available.put_nowait(connection)
+
+    @contextlib.asynccontextmanager
+    async def dedicated_connection(self) -> AsyncIterator[Connection]:
+        connection = Connection(self.database, self.database._backend)
+        await connection.__aenter__()
+        self.dedicated += 1
+        try:
+            yield connection
+        finally:
+            self.dedicated -= 1
+            await connection.__aexit__()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "available": self._available.qsize(),
+            "dedicated": self.dedicated,
+            **self.waits.stats(),
+        }
+
+
+class WriteJob(NamedTuple):
+    run: Callable[[Connection], Awaitable]
+    future: Optional[asyncio.Future]
+    enqueued_at: float
+    groupable: bool
+
+
+# The only connection that writes. A single task takes jobs from a queue and runs them one after the other on
+# it, so writes never fight over SQLite's lock. A job is a function that takes the connection.
+#
+# With group commit (group_commit_window > 0) single-statement jobs are committed in groups: a group takes
+# every groupable job that is queued and keeps taking new ones for up to group_commit_window seconds, for as
+# long as they keep arriving. It never sits idle waiting for writes that may not come, that would only slow
+# down clients that wait for their write before sending the next one. The group runs in one transaction and
+# each job gets its own result once the group commits. A statement that fails, e.g. on a constraint, only
+# rolls back itself in SQLite, so it fails just its own job. Errors that roll back the whole transaction fail
+# the jobs that ran before it too, and the jobs after it run on their own.
+class WriteQueue:
+    def __init__(self, connection: Connection, group_commit_window: float = 0, group_commit_max_size: int = 100):
+        self.connection = connection
+        self.group_commit_window = group_commit_window
+        self.group_commit_max_size = group_commit_max_size
+        self.waits = WaitStats()
+        self.failed = 0
+        self.groups = 0
+        self.grouped_jobs = 0
+        self._queue: asyncio.Queue[WriteJob] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        while not self._queue.empty():
+            future = self._queue.get_nowait().future
+            if future is not None and not future.done():
+                future.set_exception(RuntimeError("The database writer has stopped"))
+
+    async def run(self, job: Callable[[Connection], Awaitable], groupable: bool = False) -> Any:
+        # groupable: job runs a single statement and may share a transaction with other jobs
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(WriteJob(job, future, time.monotonic(), groupable))
+        return await future
+
+    @contextlib.asynccontextmanager
+    async def hold(self) -> AsyncIterator[Connection]:
+        # Keeps the writer for the whole block, for transactions that run several statements
+        started = asyncio.get_running_loop().create_future()
+        released = asyncio.Event()
+
+        async def job(connection: Connection):
+            if started.cancelled():
+                return
+            started.set_result(None)
+            await released.wait()
+
+        self._queue.put_nowait(WriteJob(job, None, time.monotonic(), False))
+        try:
+            await started
+            yield self.connection
+        finally:
+            released.set()
+
+    async def _run(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if not (job.groupable and self.group_commit_window > 0):
+                await self._run_job(job)
+                continue
+            group, next_job = await self._collect_group(job)
+            if len(group) == 1:
+                await self._run_job(group[0])
+            else:
+                await self._run_group(group)
+            if next_job is not None:
+                await self._run_job(next_job)
+
+    async def _collect_group(self, first: WriteJob) -> tuple[list[WriteJob], Optional[WriteJob]]:
+        # Returns the group and the job that ended it, if that job can't be part of a group
+        group = [first]
+        deadline = time.monotonic() + self.group_commit_window
+        while len(group) < self.group_commit_max_size:
+            if self._queue.empty():
+                if time.monotonic() >= deadline:
+                    break
+                # Let requests that are about to write queue their write
+                await asyncio.sleep(0)
+                if self._queue.empty():
+                    break
+            job = self._queue.get_nowait()
+            if not job.groupable:
+                return group, job
+            group.append(job)
+        return group, None
+
+    async def _run_job(self, job: WriteJob) -> None:
+        if job.future is not None and job.future.cancelled():
+            return
+        self.waits.record(time.monotonic() - job.enqueued_at)
+        try:
+            result = await job.run(self.connection)
+        except Exception as e:
+            self.failed += 1
+            if job.future is None:
+                logger.exception("Database write failed")
+            elif not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if job.future is not None and not job.future.done():
+                job.future.set_result(result)
+
+    async def _run_group(self, group: list[WriteJob]) -> None:
+        group = [job for job in group if not job.future.cancelled()]
+        if not group:
+            return
+        self.groups += 1
+        self.grouped_jobs += len(group)
+        raw_connection = self.connection.raw_connection
+        outcomes = []
+        not_run: list[WriteJob] = []
+        try:
+            await self._execute_raw("BEGIN")
+        except Exception as e:
+            self.failed += len(group)
+            for job in group:
+                job.future.set_exception(e)
+            return
+        for index, job in enumerate(group):
+            self.waits.record(time.monotonic() - job.enqueued_at)
+            try:
+                outcomes.append((job, await job.run(self.connection), None))
+            except Exception as e:
+                self.failed += 1
+                outcomes.append((job, None, e))
+                if not raw_connection.in_transaction:
+                    # Some errors (SQLITE_FULL, IOERR, BUSY, ON CONFLICT ROLLBACK) roll back the whole transaction,
+                    # not just the statement. The jobs before this one were lost with it, and the ones after it
+                    # must not run outside of a transaction, so they run on their own once this group is done.
+                    self.failed += sum(1 for _, _, error in outcomes[:-1] if error is None)
+                    outcomes = [(done, None, error or e) for done, _, error in outcomes]
+                    not_run = group[index + 1:]
+                    break
+        if raw_connection.in_transaction:
+            try:
+                await self._execute_raw("COMMIT")
+            except Exception as e:
+                # The commit failed, so none of the jobs were written
+                self.failed += sum(1 for _, _, error in outcomes if error is None)
+                outcomes = [(job, None, error or e) for job, _, error in outcomes]
+                if raw_connection.in_transaction:
+                    await self._execute_raw("ROLLBACK")
+        for job, result, error in outcomes:
+            if job.future.done():
+                continue
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+        for job in not_run:
+            await self._run_job(job)
+
+    async def _execute_raw(self, sql: str) -> None:
+        # Groups don't use connection.transaction(), which can't end a transaction SQLite has already rolled back
+        cursor = await self.connection.raw_connection.execute(sql)
+        await cursor.close()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "failed": self.failed,
+            "groups": self.groups,
+            "avg_group_size": self.grouped_jobs / self.groups if self.groups else 0.0,
+            **self.waits.stats(),
+        }
+
+
+# A databases.Database that sends reads to a ReadPool and writes to a WriteQueue, so code written against
+# `database` doesn't have to change: fetch_* and iterate read (iterate on a connection of its own), execute and
+# execute_many write, and transaction() holds the writer for the block (reads inside it go to the writer too, so
+# they see its writes).
+# With read_pool_size=0 it is a plain databases.Database. group_commit_window > 0 turns on group commit for
+# execute, see WriteQueue.
+class RoutedDatabase(databases.Database):
+    def __init__(
+            self,
+            url: str,
+            *,
+            read_pool_size: int = 0,
+            read_options: Optional[dict] = None,
+            group_commit_window: float = 0,
+            group_commit_max_size: int = 100,
+            **options: Any,
+    ):
+        super().__init__(url, **options)
+        self.routing = read_pool_size > 0
+        self.group_commit_window = group_commit_window
+        self.group_commit_max_size = group_commit_max_size
+        self.read_pool = ReadPool(databases.Database(url, **(read_options or {})), read_pool_size)
+        self.writer: Optional[WriteQueue] = None
+
+    async def connect(self) -> None:
+        if self.is_connected:
+            return
+        await super().connect()
+        if self.routing:
+            await self.read_pool.open()
+            writer_connection = Connection(self, self._backend)
+            await writer_connection.__aenter__()
+            self.writer = WriteQueue(writer_connection, self.group_commit_window, self.group_commit_max_size)
+            self.writer.start()
+
+    async def disconnect(self) -> None:
+        if not self.is_connected:
+            return
+        if self.writer is not None:
+            await self.writer.stop()
+            await self.writer.connection.__aexit__()
+            self.writer = None
+            await self.read_pool.close()
+        await super().disconnect()
+
+    def _routed(self) -> bool:
+        # Inside a transaction everything goes to the writer through connection()
+        return self.writer is not None and current_writer.get() is None
+
+    def connection(self) -> Connection:
+        return current_writer.get() or super().connection()
+
+    async def fetch_all(self, query, values: Optional[dict] = None):
+        if not self._routed():
+            return await super().fetch_all(query, values)
+        async with self.read_pool.connection() as connection:
+            return await connection.fetch_all(query, values)
+
+    async def fetch_one(self, query, values: Optional[dict] = None):
+        if not self._routed():
+            return await super().fetch_one(query, values)
+        async with self.read_pool.connection() as connection:
+            return await connection.fetch_one(query, values)
+
+    async def fetch_val(self, query, values: Optional[dict] = None, column: Any = 0):
+        if not self._routed():
+            return await super().fetch_val(query, values, column=column)
+        async with self.read_pool.connection() as connection:
+            return await connection.fetch_val(query, values, column=column)
+
+    async def iterate(self, query, values: Optional[dict] = None):
+        if not self._routed():
+            async for record in super().iterate(query, values):
+                yield record
+            return
+        # The caller may take its time with each record, so it doesn't get to hold one of the shared connections
+        async with self.read_pool.dedicated_connection() as connection:
+            async for record in connection.iterate(query, values):
+                yield record
+
+    async def write(self, job: Callable[[Connection], Awaitable], groupable: bool = False) -> Any:
+        # Runs job with the connection that writes: queued for the writer, or right away when this task is
+        # already holding it
+        if not self._routed():
+            async with self.connection() as connection:
+                return await job(connection)
+        return await self.writer.run(job, groupable)
+
+    async def execute(self, query, values: Optional[dict] = None):
+        return await self.write(lambda connection: connection.execute(query, values), groupable=True)
+
+    async def execute_many(self, query, values: list):
+        return await self.write(lambda connection: connection.execute_many(query, values))
+
+    def transaction(self, *, force_rollback: bool = False, **kwargs: Any):
+        if not self._routed():
+            return super().transaction(force_rollback=force_rollback, **kwargs)
+        return self._writer_transaction(force_rollback=force_rollback, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def _writer_transaction(self, **kwargs: Any) -> AsyncIterator[None]:
+        async with self.writer.hold() as connection:
+            token = current_writer.set(connection)
+            try:
+                async with connection.transaction(**kwargs):
+                    yield
+            finally:
+                current_writer.reset(token)
+
+    def stats(self) -> dict:
+        if self.writer is None:
+            return {"routing": False}
+        return {"routing": True, "read_pool": self.read_pool.stats(), "writer": self.writer.stats()}
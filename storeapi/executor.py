@@ -0,0 +1,64 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+# Runs blocking functions (like bcrypt) in a thread pool of its own so they don't block the event loop and
+# can't take over the threads other code runs in. At most max_workers calls run at once, the others wait in
+# line on the event loop, where we can count them.
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self._slots = asyncio.Semaphore(max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        # timeout: seconds fn may run before we stop waiting for it and raise TimeoutError. A thread can't be
+        # stopped, so the call keeps its slot until fn really returns.
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=self.name)
+        future = asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+        future.add_done_callback(self._finished)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except TimeoutError:
+            self.timed_out += 1
+            raise
+
+    def _finished(self, future: asyncio.Future) -> None:
+        self.active -= 1
+        self.completed += 1
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+        self._slots.release()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "active": self.active,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+        }
@@ -1,13 +1,24 @@
+import asyncio
+import hashlib
+import io
 import logging
 from functools import lru_cache
-import b2sdk.v2 as b2
+from typing import TYPE_CHECKING, Optional, Protocol
+from storeapi import metrics
 from storeapi.config import config
+from storeapi.executor import BoundedExecutor
+
+# b2sdk takes a while to import and only uploads need it, so it is imported the first time we talk to B2
+if TYPE_CHECKING:
+    import b2sdk.v2 as b2
 
 logger = logging.getLogger(__name__)
 
 
 @lru_cache()
-def b2_api():
+def b2_api() -> "b2.B2Api":
+    import b2sdk.v2 as b2
+
     logger.debug("Creating and authorizing B2 API")
     info = b2.InMemoryAccountInfo()
     b2_api = b2.B2Api(info)
@@ -16,7 +27,7 @@ def b2_api():
 
 
 @lru_cache()
-def b2_get_bucket(api: b2.B2Api):
+def b2_get_bucket(api: "b2.B2Api"):
     return api.get_bucket_by_name(config.B2_BUCKET_NAME)
 
 
@@ -30,4 +41,114 @@ def b2_upload_file(local_file: str, file_name: str) -> str:
     logger.debug(
         f"Uploaded {local_file} to B2 successfully and got download URL {download_url}"
     )
-    return download_url
\ No newline at end of file
+    return download_url
+
+
+# Uploading to B2 blocks until the whole file is sent, so async routes must run it here, e.g.
+# `await b2_uploader.run(b2_upload_file, local_file, file_name)`, otherwise every other request waits for it
+b2_uploader = BoundedExecutor("b2-upload", config.B2_UPLOAD_WORKERS)
+metrics.register("b2_uploads", b2_uploader.stats)
+
+
+class AsyncReader(Protocol):
+    async def read(self, size: int) -> bytes: ...
+
+
+def b2_upload_part(api: "b2.B2Api", file_id: str, part_number: int, data: bytes) -> str:
+    # Returns the part's SHA1, which finishing the file needs
+    sha1 = hashlib.sha1(data).hexdigest()
+    api.session.upload_part(file_id, part_number, len(data), sha1, io.BytesIO(data))
+    return sha1
+
+
+# Sends a file to B2 while it is still being read, without writing it to disk first. What is written is kept in
+# memory until there is more than a part's worth; a file that never gets that big is sent in one go, and a bigger
+# one becomes a B2 large file whose parts go up on b2_uploader as soon as they are full. At most
+# max_parts_in_flight parts are uploading at once and write() waits for one to finish before taking more, so an
+# upload never holds more than about (max_parts_in_flight + 1) * part_size bytes.
+class B2StreamingUpload:
+    def __init__(self, file_name: str, part_size: int, max_parts_in_flight: int):
+        self.file_name = file_name
+        self.part_size = part_size
+        self.api: Optional["b2.B2Api"] = None
+        self.bucket: Optional["b2.Bucket"] = None
+        self.file_id: Optional[str] = None
+        self._buffer = bytearray()
+        self._parts: list[asyncio.Task] = []
+        self._in_flight = asyncio.Semaphore(max_parts_in_flight)
+
+    async def _connect(self) -> None:
+        if self.api is None:
+            self.api = await b2_uploader.run(b2_api)
+            self.bucket = await b2_uploader.run(b2_get_bucket, self.api)
+            # B2 rejects parts smaller than this, except for the last one
+            self.part_size = max(self.part_size, self.api.account_info.get_absolute_minimum_part_size())
+
+    async def write(self, data: bytes) -> None:
+        await self._connect()
+        self._buffer += data
+        # Keep back at least one byte, so the last part is never empty and a large file always has two parts
+        while len(self._buffer) > self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._send_part(part)
+
+    async def _send_part(self, data: bytes) -> None:
+        for task in self._parts:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+        await self._in_flight.acquire()
+        try:
+            if self.file_id is None:
+                self.file_id = (await b2_uploader.run(
+                    self.api.session.start_large_file, self.bucket.id_, self.file_name, "b2/x-auto", {}
+                ))["fileId"]
+                logger.debug(f"Started B2 large file {self.file_id} for {self.file_name}")
+        except BaseException:
+            self._in_flight.release()
+            raise
+        part_number = len(self._parts) + 1
+        self._parts.append(asyncio.create_task(self._upload_part(part_number, data)))
+
+    async def _upload_part(self, part_number: int, data: bytes) -> str:
+        try:
+            return await b2_uploader.run(b2_upload_part, self.api, self.file_id, part_number, data)
+        finally:
+            self._in_flight.release()
+
+    async def finish(self) -> str:
+        # Sends what is left and returns the download URL
+        await self._connect()
+        if self.file_id is None:
+            uploaded_file = await b2_uploader.run(self.bucket.upload_bytes, bytes(self._buffer), self.file_name)
+            return self.api.get_download_url_for_fileid(uploaded_file.id_)
+        await self._send_part(bytes(self._buffer))
+        self._buffer.clear()
+        sha1s = await asyncio.gather(*self._parts)
+        await b2_uploader.run(self.api.session.finish_large_file, self.file_id, sha1s)
+        logger.debug(f"Uploaded {self.file_name} to B2 in {len(sha1s)} parts")
+        return self.api.get_download_url_for_fileid(self.file_id)
+
+    async def abort(self) -> None:
+        # Stops uploading parts and cancels the large file on B2, so its parts don't linger there
+        for task in self._parts:
+            task.cancel()
+        await asyncio.gather(*self._parts, return_exceptions=True)
+        if self.file_id is not None:
+            try:
+                await b2_uploader.run(self.api.session.cancel_large_file, self.file_id)
+            except Exception:
+                logger.exception(f"Could not cancel B2 large file {self.file_id}")
+
+
+async def b2_stream_file(file: AsyncReader, file_name: str, chunk_size: int) -> str:
+    # Uploads everything read from file to B2 as file_name and returns the download URL. Cancelling it, e.g. with
+    # asyncio.timeout, cancels the large file on B2 too
+    upload = B2StreamingUpload(file_name, config.B2_UPLOAD_PART_SIZE, config.B2_UPLOAD_PARTS_IN_FLIGHT)
+    try:
+        while chunk := await file.read(chunk_size):
+            await upload.write(chunk)
+        return await upload.finish()
+    except BaseException:
+        await upload.abort()
+        raise
@@ -0,0 +1,89 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Write-behind buffer for likes. Likes are acknowledged as soon as they are added and written to the database in
+# batches by a background task, either once max_size likes are waiting or max_delay seconds after the oldest one
+# arrived, whichever comes first. `stop` lets a write that is under way finish and writes out everything still
+# waiting, so no acknowledged like is lost on shutdown.
+class LikeBuffer:
+    def __init__(self, write_likes: Callable[[list[dict]], Awaitable], max_size: int, max_delay: float):
+        self.write_likes = write_likes
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self._pending: list[dict] = []
+        self._oldest: Optional[float] = None
+        self._full = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, like: dict) -> None:
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending.append(like)
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[: self.max_size]
+                del self._pending[: len(batch)]
+                await self._write(batch)
+            self._oldest = None
+            self._full.clear()
+
+    async def _write(self, batch: list[dict]) -> None:
+        self.flushes += 1
+        try:
+            await self.write_likes(batch)
+            self.written += len(batch)
+            return
+        except Exception:
+            logger.exception(f"Writing a batch of {len(batch)} likes failed, writing them one at a time")
+        # One bad like (e.g. for a post that has gone) fails the whole transaction, so retry them one by one
+        for like in batch:
+            try:
+                await self.write_likes([like])
+                self.written += 1
+            except Exception:
+                logger.exception(f"Dropping like on post {like.get('post_id')}")
+                self.failed += 1
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._full.wait(), timeout=self.max_delay)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            # Cancelling the task could cut off a batch that has already left _pending, so ask it to stop instead
+            self._stopping.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "oldest_pending_seconds": time.monotonic() - self._oldest if self._oldest is not None else 0.0,
+            "written": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+        }
@@ -3,11 +3,15 @@ from contextlib import asynccontextmanager
 from asgi_correlation_id import CorrelationIdMiddleware
 from fastapi import FastAPI, HTTPException
 from fastapi.exception_handlers import http_exception_handler
-from storeapi.database import database
+from storeapi.config import config
+from storeapi.database import database, init_db
+from storeapi.libs.b2 import b2_uploader
 from storeapi.logging_conf import configure_logging
-from storeapi.routers.post import router as post_router
+from storeapi.routers.post import router as post_router, load_post_ranking, like_buffer
 from storeapi.routers.user import router as user_router
+from storeapi.routers.metrics import router as metrics_router
 from storeapi.routers.upload import router as upload_router
+from storeapi.security import password_hasher, calibrate_password_hashing
 
 
 logger = logging.getLogger(__name__)
@@ -18,9 +22,18 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     configure_logging()
+    calibrate_password_hashing()
+    init_db()
     await database.connect()
+    await load_post_ranking()
+    if config.LIKE_BUFFER_ENABLED:
+        like_buffer.start()
     yield
+    # Write out buffered likes before the database goes away
+    await like_buffer.stop()
     await database.disconnect()
+    password_hasher.shutdown()
+    b2_uploader.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -31,6 +44,7 @@ app.add_middleware(CorrelationIdMiddleware)
 app.include_router(post_router)
 app.include_router(user_router)
 app.include_router(upload_router)
+app.include_router(metrics_router)
 
 @app.exception_handler(HTTPException)
 async def http_exception_handle_logging(request, exc):
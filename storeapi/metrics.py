@@ -0,0 +1,12 @@
+from typing import Callable
+
+# Components register a function that returns their current counters and GET /metrics reports all of them
+collectors: dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, collector: Callable[[], dict]) -> None:
+    collectors[name] = collector
+
+
+def snapshot() -> dict:
+    return {name: collector() for name, collector in collectors.items()}
@@ -19,6 +19,11 @@ class UserPostWithLikes(UserPost):
     likes: int
 
 
+class UserPostPage(BaseModel):
+    posts: list[UserPostWithLikes]
+    next_cursor: Optional[str] = None
+
+
 class CommentIn(BaseModel):
     body: str
     post_id: int
@@ -39,6 +44,13 @@ class PostLike(PostLikeIn):
     user_id: int
 
 
+class BulkItemResult(BaseModel):
+    index: int
+    status_code: int
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+
 class UserPostWithComments(BaseModel):
     post: UserPostWithLikes
     comments: list[Comment]
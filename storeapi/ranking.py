@@ -0,0 +1,75 @@
+import bisect
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def ranking_key(post: dict) -> tuple[int, int]:
+    # Sorting ascending by this key gives most likes first, and newest first for posts with the same likes,
+    # which is the same order as the most_likes feed query
+    return -post["likes"], -post["id"]
+
+
+# Process-local index of the `capacity` posts with the most likes. It is cold until `load` is called with the
+# top posts from the database, and while cold `page` returns None so callers fall back to SQL. Likes only ever
+# go up and new posts start at zero likes, so as long as every write goes through `upsert` the index keeps
+# holding exactly the top posts.
+class PostRanking:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.loaded = False
+        # True when every post in the database fits in the index, so a short page really is the last page
+        self.complete = False
+        self._keys: list[tuple[int, int]] = []
+        self._posts: dict[int, dict] = {}
+
+    def clear(self) -> None:
+        self.loaded = False
+        self.complete = False
+        self._keys = []
+        self._posts = {}
+
+    def load(self, posts: list[dict]) -> None:
+        # Expects the top posts in ranking order. Pass capacity + 1 rows so we can tell if there are more posts
+        # in the database than fit in the index.
+        self.clear()
+        for post in posts[: self.capacity]:
+            post = dict(post)
+            self._keys.append(ranking_key(post))
+            self._posts[post["id"]] = post
+        self.complete = len(posts) <= self.capacity
+        self.loaded = True
+        logger.debug(f"Loaded {len(self._keys)} posts into the ranking index")
+
+    def upsert(self, post: dict) -> None:
+        if not self.loaded:
+            return
+        post = dict(post)
+        key = ranking_key(post)
+        existing = self._posts.get(post["id"])
+        if existing is not None:
+            if existing["likes"] > post["likes"]:
+                # An older update arriving after a newer one
+                return
+            del self._keys[bisect.bisect_left(self._keys, ranking_key(existing))]
+        elif not self.complete and self._keys and key > self._keys[-1]:
+            # Ranks below everything we hold, and we don't hold every post
+            return
+        bisect.insort(self._keys, key)
+        self._posts[post["id"]] = post
+        if len(self._keys) > self.capacity:
+            evicted = self._keys.pop()
+            del self._posts[-evicted[1]]
+            self.complete = False
+
+    def page(self, limit: int, after: Optional[dict] = None) -> Optional[list[dict]]:
+        # Returns up to limit + 1 posts ranked after the `after` cursor, or None if the index can't answer
+        if not self.loaded:
+            return None
+        start = bisect.bisect_right(self._keys, ranking_key(after)) if after else 0
+        keys = self._keys[start:start + limit + 1]
+        if len(keys) <= limit and not self.complete:
+            # The page runs past the end of the index and there are more posts in the database
+            return None
+        return [self._posts[-post_id] for _, post_id in keys]
@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+# Token buckets per key (e.g. per client IP). Every key may make `burst` requests at once and then `rate` per
+# second. A bucket that has been idle long enough to fill up again is the same as no bucket at all, so those are
+# dropped, and the least recently used buckets go first once there are more than max_keys. Buckets are kept as
+# (tokens, updated) tuples in an OrderedDict ordered by last use, so expiring them is a scan from the front.
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: int, max_keys: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self.allowed = 0
+        self.limited = 0
+        self._refill_seconds = burst / rate
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: Hashable) -> float:
+        # Takes a token for key. Returns 0 if the request may go ahead, or else how many seconds until it may.
+        now = self.clock()
+        self._expire(now)
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            self.allowed += 1
+            retry_after = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            self.limited += 1
+            retry_after = (1 - tokens) / self.rate
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def _expire(self, now: float) -> None:
+        while self._buckets:
+            key, (tokens, updated) = next(iter(self._buckets.items()))
+            if now - updated < self._refill_seconds:
+                break
+            del self._buckets[key]
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "allowed": self.allowed, "limited": self.limited}
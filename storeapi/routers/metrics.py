@@ -0,0 +1,11 @@
+import logging
+from fastapi import APIRouter
+from storeapi import metrics
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
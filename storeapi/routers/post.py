@@ -1,9 +1,21 @@
+import base64
+import binascii
+import collections
+import csv
+import io
+import json
 import logging
-from typing import Annotated
+from typing import Annotated, Optional
 from enum import Enum
 import sqlalchemy
-from fastapi import APIRouter, HTTPException, Request, Depends
-from storeapi.database import comment_table, post_table, database, like_table
+from fastapi import APIRouter, HTTPException, Request, Depends, Query, Header, Body
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from storeapi import metrics
+from storeapi.cache import LRUCache, VersionMap
+from storeapi.config import config
+from storeapi.database import (
+    comment_table, post_table, database, like_table, execute_many, integrity_errors, post_search_table
+)
 from storeapi.models.post import (
     UserPost,
     UserPostIn,
@@ -12,8 +24,14 @@ from storeapi.models.post import (
     PostLikeIn,
     PostLike,
     UserPostWithComments,
-    UserPostWithLikes)
+    UserPostWithLikes,
+    UserPostPage,
+    BulkItemResult)
+from storeapi.like_buffer import LikeBuffer
 from storeapi.models.user import User
+from storeapi.ranking import PostRanking
+from storeapi.serialization import dump_json, row_to_dict, rows_to_dicts
+from storeapi.statements import Statement, BoundStatement
 from storeapi.security import oauth2_scheme, get_current_user
 
 # An API router is basically a fastapi app but instead of running on its own it can be included be included into an existing app.
@@ -22,16 +40,91 @@ router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
-select_post_and_likes = (
-    sqlalchemy.select(post_table, sqlalchemy.func.count(like_table.c.id).label("likes"))
-    .select_from(post_table.outerjoin(like_table))
-    .group_by(post_table.c.id)
+# Likes are read from the denormalized like_count column that like_post keeps up to date, so reading a post
+# doesn't need to join and count the likes table
+select_post_and_likes = sqlalchemy.select(
+    post_table.c.id,
+    post_table.c.body,
+    post_table.c.user_id,
+    post_table.c.image_url,
+    post_table.c.like_count.label("likes"),
 )
 
+# Serialized JSON of the feed and post detail responses. Entries are tagged with what they depend on:
+#   ("feed", sorting)   - a page of the feed, dropped when a post is created (or liked, for most_likes)
+#   ("likes", post_id)  - a response that shows the likes of the post
+#   ("comments", post_id) - a response that shows the comments of the post
+# Writes invalidate only the tags they affect. The TTL bounds how long a response computed concurrently with
+# a write can stay stale.
+response_cache = LRUCache(max_size=config.RESPONSE_CACHE_MAX_BYTES, ttl=config.RESPONSE_CACHE_TTL)
+metrics.register("response_cache", response_cache.stats)
+
+
+def cached_response(key) -> Optional[Response]:
+    entry = response_cache.get(key)
+    if entry is None:
+        return None
+    content, headers = entry
+    return json_response(content, headers={**headers, "X-Cache": "HIT"})
+
+
+def json_response(content: bytes, headers: Optional[dict] = None) -> Response:
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def cache_response(key, content: bytes, tags, headers: Optional[dict] = None, store: bool = True) -> Response:
+    headers = headers or {}
+    if store:
+        response_cache.set(key, (content, headers), size=len(content), tags=tags)
+    return json_response(content, headers={**headers, "X-Cache": "MISS"})
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return etag in candidates
+
+
+# Top posts by likes, served from memory for sorting=most_likes once load_post_ranking has run at startup
+post_ranking = PostRanking(config.POST_RANKING_SIZE)
+
+
+# These keep the in-memory views (ranking index and response cache) in step with the database.
+# Call them once the write has been committed.
+def posts_created(posts: list[dict]) -> None:
+    for post in posts:
+        post_ranking.upsert({"image_url": None, **post, "likes": 0})
+    for sorting in PostSorting:
+        feed_versions.bump(sorting.value)
+        response_cache.invalidate_tag(("feed", sorting.value))
+
+
+def comments_created(post_ids: list[int]) -> None:
+    for post_id in set(post_ids):
+        response_cache.invalidate_tag(("comments", post_id))
+
+
+def posts_liked(posts: list[dict]) -> None:
+    # `posts` are rows of select_post_and_likes read after the like was written
+    for post in posts:
+        post_ranking.upsert(post)
+        response_cache.invalidate_tag(("likes", post["id"]))
+    # Every feed shows like counts, so a read of any sorting may have missed this like
+    for sorting in PostSorting:
+        feed_versions.bump(sorting.value)
+    response_cache.invalidate_tag(("feed", PostSorting.most_likes.value))
+
+
+# Queries that run on every request are prepared once as Statements with named bindparams, see statements.py
+find_post_statement = Statement(post_table.select().where(post_table.c.id == sqlalchemy.bindparam("post_id")))
+insert_post_statement = Statement(post_table.insert(), column_keys=["body", "user_id"])
+
 
 async def find_post(post_id: int):
     logger.info(f"Finding post with id of {post_id}")
-    query = post_table.select().where(post_table.c.id == post_id)
+    query = find_post_statement(post_id=post_id)
     logger.debug(query)
     return await database.fetch_one(query)
 
@@ -45,9 +138,10 @@ async def find_post(post_id: int):
 async def create_post(post: UserPostIn, current_user: Annotated[User, Depends(get_current_user)]):
     logger.info("Creating Post")
     data = {**post.model_dump(), "user_id": current_user.id}
-    query = post_table.insert().values(data)
+    query = insert_post_statement(**data)
     logger.debug(query)
     last_record_id = await database.execute(query)
+    posts_created([{**data, "id": last_record_id}])
     return {**data, "id": last_record_id}
 
 
@@ -57,68 +151,495 @@ class PostSorting(str, Enum):
     most_likes = "most_likes"
 
 
-@router.get("/post", response_model=list[UserPostWithLikes])
-async def get_all_posts(sorting: PostSorting = PostSorting.new):
-    logger.info("Getting all posts")
+# Per-sorting feed versions, bumped whenever a write changes what a feed shows. A feed read that saw a version
+# change while it was waiting on the database may have read rows from before the write, so it isn't cached.
+feed_versions = VersionMap(max_entries=len(PostSorting))
+
+
+def encode_cursor(**values: int) -> str:
+    # Cursors hold where the next page starts, e.g. the sort key of the last post on a page. They are opaque to
+    # clients so we are free to change what goes into them later.
+    payload = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *keys: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return {key: int(payload[key]) for key in keys}
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
+def feed_statement(sorting: PostSorting, after: bool) -> Statement:
+    # Keyset pagination: instead of OFFSET we continue right after the sort key of the last post we returned,
+    # so every page costs the same no matter how deep the client scrolls.
+    after_id = sqlalchemy.bindparam("after_id")
     if sorting == PostSorting.new:
         query = select_post_and_likes.order_by(post_table.c.id.desc())
+        if after:
+            query = query.where(post_table.c.id < after_id)
     elif sorting == PostSorting.old:
         query = select_post_and_likes.order_by(post_table.c.id.asc())
+        if after:
+            query = query.where(post_table.c.id > after_id)
     elif sorting == PostSorting.most_likes:
-        query = select_post_and_likes.order_by(sqlalchemy.desc("likes"))
+        # Posts with the same number of likes are ordered by id so that the order is stable between pages
+        query = select_post_and_likes.order_by(post_table.c.like_count.desc(), post_table.c.id.desc())
+        if after:
+            after_likes = sqlalchemy.bindparam("after_likes")
+            query = query.where(
+                sqlalchemy.or_(
+                    post_table.c.like_count < after_likes,
+                    sqlalchemy.and_(post_table.c.like_count == after_likes, post_table.c.id < after_id),
+                )
+            )
+    return Statement(query.limit(sqlalchemy.bindparam("limit", type_=sqlalchemy.Integer)))
+
+
+# One statement for the first page and one for the following pages of every sorting
+feed_statements = {(sorting, after): feed_statement(sorting, after) for sorting in PostSorting for after in (False, True)}
+
+
+def build_feed_query(sorting: PostSorting, limit: int, after: Optional[dict] = None) -> BoundStatement:
+    # We fetch one extra row to find out whether there is a next page
+    values = {"limit": limit + 1}
+    if after:
+        values.update(after_id=after["id"], after_likes=after["likes"])
+    return feed_statements[(sorting, bool(after))](**values)
+
+
+async def load_post_ranking():
+    logger.info("Loading most liked posts into the ranking index")
+    query = build_feed_query(PostSorting.most_likes, post_ranking.capacity)
+    posts = await database.fetch_all(query)
+    post_ranking.load([dict(post._mapping) for post in posts])
+
+
+@router.get("/post", response_model=UserPostPage)
+async def get_all_posts(
+        sorting: PostSorting = PostSorting.new,
+        limit: Annotated[int, Query(ge=1, le=100)] = 20,
+        cursor: Optional[str] = None,
+):
+    logger.info("Getting all posts")
+    cache_key = ("feed", sorting.value, limit, cursor)
+    if cached := cached_response(cache_key):
+        return cached
+    version = feed_versions.get(sorting.value)
+    after = decode_cursor(cursor, "id", "likes") if cursor else None
+    posts = post_ranking.page(limit, after) if sorting == PostSorting.most_likes else None
+    if posts is None:
+        query = build_feed_query(sorting, limit, after)
+        logger.debug(query)
+        posts = await database.fetch_all(query)
+    next_cursor = None
+    if len(posts) > limit:
+        next_cursor = encode_cursor(id=posts[limit - 1]["id"], likes=posts[limit - 1]["likes"])
+    posts = rows_to_dicts(posts[:limit], UserPostWithLikes)
+    tags = [("feed", sorting.value), *[("likes", post["id"]) for post in posts]]
+    return cache_response(
+        cache_key, dump_json({"posts": posts, "next_cursor": next_cursor}), tags,
+        store=feed_versions.get(sorting.value) == version,
+    )
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+def select_post_and_comments(comments):
+    # A post joined with its comments: one row per comment, or a single row with NULL comment columns for a
+    # post without comments. `comments` is the comments table or a subquery of it.
+    return (
+        sqlalchemy.select(
+            *select_post_and_likes.selected_columns,
+            comments.c.id.label("comment_id"),
+            comments.c.body.label("comment_body"),
+            comments.c.user_id.label("comment_user_id"),
+        )
+        .select_from(post_table.outerjoin(comments, comments.c.post_id == post_table.c.id))
+    )
+
+
+def post_from_row(row) -> dict:
+    return row_to_dict(row, UserPostWithLikes)
+
+
+def comment_from_row(row) -> Optional[dict]:
+    if row["comment_id"] is None:
+        return None
+    # Same fields and order as the Comment model
+    return {
+        "body": row["comment_body"],
+        "post_id": row["id"],
+        "id": row["comment_id"],
+        "user_id": row["comment_user_id"],
+    }
+
+
+# Every post with its comments, ordered by post so the rows of one post arrive together
+export_statement = Statement(select_post_and_comments(comment_table).order_by(post_table.c.id, comment_table.c.id))
+
+export_csv_columns = [
+    "id", "body", "user_id", "image_url", "likes", "comment_id", "comment_body", "comment_user_id"
+]
+
+
+async def export_posts_ndjson():
+    # One line per post in the same shape as GET /post/{post_id}. Only the comments of the current post are
+    # held in memory.
+    current = None
+    async for row in database.iterate(export_statement()):
+        if current is None or current["post"]["id"] != row["id"]:
+            if current is not None:
+                yield dump_json(current) + b"\n"
+            current = {"post": post_from_row(row), "comments": []}
+        if comment := comment_from_row(row):
+            current["comments"].append(comment)
+    if current is not None:
+        yield dump_json(current) + b"\n"
+
+
+async def export_posts_csv():
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_csv_columns)
+    yield buffer.getvalue()
+    async for row in database.iterate(export_statement()):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([row[column] for column in export_csv_columns])
+        yield buffer.getvalue()
+
+
+# Registered before /post/{post_id} so "export" isn't matched as a post id
+@router.get("/post/export")
+async def export_posts(format: ExportFormat = ExportFormat.ndjson):
+    logger.info(f"Exporting all posts as {format.value}")
+    if format == ExportFormat.csv:
+        return StreamingResponse(
+            export_posts_csv(),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=posts.csv"},
+        )
+    return StreamingResponse(export_posts_ndjson(), media_type="application/x-ndjson")
+
+
+def search_terms(q: str) -> str:
+    # Quote every word so user input is always matched as plain words and never parsed as FTS5 query syntax.
+    # Words separated by spaces must all be present.
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+
+# Best matches first (bm25 is lower for better matches), newest first for equally good matches
+search_match = sqlalchemy.literal_column("posts_fts")
+search_statement = Statement(
+    select_post_and_likes
+    .join_from(post_table, post_search_table, post_search_table.c.rowid == post_table.c.id)
+    .where(search_match.op("MATCH")(sqlalchemy.bindparam("terms", type_=sqlalchemy.String)))
+    .order_by(sqlalchemy.func.bm25(search_match), post_table.c.id.desc())
+    .limit(sqlalchemy.bindparam("limit", type_=sqlalchemy.Integer))
+    .offset(sqlalchemy.bindparam("offset", type_=sqlalchemy.Integer))
+)
+
+
+def build_search_query(terms: str, limit: int, offset: int = 0) -> BoundStatement:
+    return search_statement(terms=terms, limit=limit + 1, offset=offset)
 
+
+# Registered before /post/{post_id} so "search" isn't matched as a post id
+@router.get("/post/search", response_model=UserPostPage)
+async def search_posts(
+        q: Annotated[str, Query(min_length=1, max_length=200)],
+        limit: Annotated[int, Query(ge=1, le=100)] = 20,
+        cursor: Optional[str] = None,
+):
+    logger.info("Searching posts")
+    terms = search_terms(q)
+    if not terms:
+        return json_response(dump_json({"posts": [], "next_cursor": None}))
+    # Relevance depends on the whole result set, so search pages by offset rather than by sort key
+    offset = decode_cursor(cursor, "offset")["offset"] if cursor else 0
+    query = build_search_query(terms, limit, offset)
     logger.debug(query)
-    return await database.fetch_all(query)
+    posts = await database.fetch_all(query)
+    next_cursor = encode_cursor(offset=offset + limit) if len(posts) > limit else None
+    posts = rows_to_dicts(posts[:limit], UserPostWithLikes)
+    return json_response(dump_json({"posts": posts, "next_cursor": next_cursor}))
+
+
+insert_comment_statement = Statement(comment_table.insert(), column_keys=["body", "post_id", "user_id"])
+bump_post_version_statement = Statement(
+    post_table.update()
+    .where(post_table.c.id == sqlalchemy.bindparam("post_id"))
+    .values(version=post_table.c.version + 1)
+)
 
 
 @router.post("/comment", response_model=Comment, status_code=201)
 async def create_comment(comment: CommentIn, current_user: Annotated[User, Depends(get_current_user)]):
     logger.info("Creating comment")
-    post = await find_post(comment.post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
     data = {**comment.model_dump(), "user_id": current_user.id}
-    query = comment_table.insert().values(data)
+    query = insert_comment_statement(**data)
     logger.debug(query, extra={"email": "saurabh.jaiswal@net"})
-    last_record_id = await database.execute(query)
+    # The foreign key on post_id rejects comments on posts that don't exist, so we don't look the post up first
+    try:
+        async with database.transaction():
+            last_record_id = await database.execute(query)
+            await database.execute(bump_post_version_statement(post_id=comment.post_id))
+    except integrity_errors as e:
+        raise HTTPException(status_code=404, detail="Post not found") from e
+    comments_created([comment.post_id])
     return {**data, "id": last_record_id}
 
 
-@router.get("/post/{post_id}/comment", response_model=list[Comment])
-async def get_comments_on_post(post_id: int):
-    logger.info("Getting comment on post")
-    query = comment_table.select().where(comment_table.c.post_id == post_id)
+def select_comments_page(after: bool):
+    # Comments are paginated by id: pass the id of the last comment you got as after_id to get the next page
+    query = comment_table.select().where(comment_table.c.post_id == sqlalchemy.bindparam("post_id"))
+    if after:
+        query = query.where(comment_table.c.id > sqlalchemy.bindparam("after_id"))
+    return query.order_by(comment_table.c.id).limit(sqlalchemy.bindparam("limit", type_=sqlalchemy.Integer))
+
+
+def select_post_with_comments_page(after: bool):
+    # The post and its first page of comments in a single query
+    comments_page = select_comments_page(after).subquery()
+    return (
+        select_post_and_comments(comments_page)
+        .where(post_table.c.id == sqlalchemy.bindparam("post_id"))
+        .order_by(comments_page.c.id)
+    )
+
+
+comments_statements = {after: Statement(select_comments_page(after)) for after in (False, True)}
+post_with_comments_statements = {after: Statement(select_post_with_comments_page(after)) for after in (False, True)}
+
+
+def build_comments_query(post_id: int, limit: int, after_id: Optional[int] = None) -> BoundStatement:
+    return comments_statements[after_id is not None](post_id=post_id, limit=limit, after_id=after_id)
+
+
+async def find_comments(post_id: int, limit: int, after_id: Optional[int] = None):
+    query = build_comments_query(post_id, limit, after_id)
     logger.debug(query)
     return await database.fetch_all(query)
 
 
+def build_post_with_comments_query(post_id: int, limit: int, after_id: Optional[int] = None) -> BoundStatement:
+    return post_with_comments_statements[after_id is not None](post_id=post_id, limit=limit, after_id=after_id)
+
+
+CommentLimit = Annotated[int, Query(ge=1, le=500)]
+
+post_version_statement = Statement(
+    sqlalchemy.select(post_table.c.version).where(post_table.c.id == sqlalchemy.bindparam("post_id"))
+)
+
+
+async def post_etag(post_id: int) -> Optional[str]:
+    # The post's version comes from the database, so an ETag handed out by one worker is invalidated by a comment
+    # or like written through any other. None if there is no such post.
+    version = await database.fetch_val(post_version_statement(post_id=post_id))
+    return None if version is None else f'"{post_id}-{version}"'
+
+
+@router.get("/post/{post_id}/comment", response_model=list[Comment])
+async def get_comments_on_post(
+        post_id: int,
+        limit: CommentLimit = 100,
+        after_id: Optional[int] = None,
+        if_none_match: Annotated[Optional[str], Header()] = None,
+):
+    logger.info("Getting comment on post")
+    # Read the version before querying: if a write lands while we query, the response goes out with the older
+    # ETag and the client simply fetches again next time. Cached responses are keyed by the version too, so one
+    # that another worker's write has made stale is never served.
+    etag = await post_etag(post_id)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    cache_key = ("comments", post_id, etag, limit, after_id)
+    if cached := cached_response(cache_key):
+        return cached
+    comments = dump_json(rows_to_dicts(await find_comments(post_id, limit, after_id), Comment))
+    return cache_response(cache_key, comments, [("comments", post_id)], headers={"ETag": etag} if etag else None)
+
+
 @router.get("/post/{post_id}", response_model=UserPostWithComments)
-async def get_post_with_comments(post_id: int):
+async def get_post_with_comments(
+        post_id: int,
+        limit: CommentLimit = 100,
+        after_id: Optional[int] = None,
+        if_none_match: Annotated[Optional[str], Header()] = None,
+):
     logger.info("Getting post and its comments")
-    query = select_post_and_likes.where(post_table.c.id == post_id)
+    etag = await post_etag(post_id)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    cache_key = ("post", post_id, etag, limit, after_id)
+    if cached := cached_response(cache_key):
+        return cached
+    query = build_post_with_comments_query(post_id, limit, after_id)
     logger.debug(query)
-    post = await database.fetch_one(query)
-    if not post:
+    rows = await database.fetch_all(query)
+    if not rows:
         raise HTTPException(status_code=404, detail="Post not found")
-    return {
-        "post": post, "comments": await get_comments_on_post(post_id),
-    }
+    post_with_comments = dump_json({
+        "post": post_from_row(rows[0]),
+        "comments": [comment for row in rows if (comment := comment_from_row(row))],
+    })
+    return cache_response(
+        cache_key, post_with_comments, [("likes", post_id), ("comments", post_id)], headers={"ETag": etag}
+    )
 
 
-@router.post("/like", response_model=PostLike, status_code=201)
+insert_like_statement = Statement(like_table.insert(), column_keys=["post_id", "user_id"])
+count_like_statement = Statement(
+    post_table.update()
+    .where(post_table.c.id == sqlalchemy.bindparam("post_id"))
+    .values(like_count=post_table.c.like_count + 1, version=post_table.c.version + 1)
+    .returning(*select_post_and_likes.selected_columns)
+)
+
+
+@router.post(
+    "/like",
+    response_model=PostLike,
+    status_code=201,
+    responses={202: {"description": "The like was queued and will be written shortly (LIKE_BUFFER_ENABLED)"}},
+)
 async def like_post(
         like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)]
 ):
     logger.info("Liking Post")
-    post = await find_post(like.post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
     data = {**like.model_dump(), "user_id": current_user.id}
-    query = like_table.insert().values(data)
+    if config.LIKE_BUFFER_ENABLED:
+        # A buffered like is acknowledged before it is written, so the post has to be checked up front
+        if not await find_post(like.post_id):
+            raise HTTPException(status_code=404, detail="Post not found")
+        like_buffer.add(data)
+        return JSONResponse(status_code=202, content=data)
+    query = insert_like_statement(**data)
     logger.debug(query)
-    last_record_id = await database.execute(query)
+    # The like and the counter on the post are written together so the counter can't drift from the likes table.
+    # The foreign key on post_id rejects likes on posts that don't exist.
+    try:
+        async with database.transaction():
+            last_record_id = await database.execute(query)
+            liked_post = await database.fetch_one(count_like_statement(post_id=like.post_id))
+            if liked_post is None:
+                # No row back means no such post. Raising rolls the like back too
+                raise HTTPException(status_code=404, detail="Post not found")
+    except integrity_errors as e:
+        raise HTTPException(status_code=404, detail="Post not found") from e
+    posts_liked([dict(liked_post._mapping)])
     return {**data, "id": last_record_id}
 
+# Bulk variants of the write endpoints. Each call authenticates once, checks every referenced post with one
+# query and writes all rows with a single executemany in one transaction. Results are reported per item, in
+# the order the items were sent, so a bad item doesn't fail the rest of the batch.
+BulkItems = Body(min_length=1, max_length=config.BULK_MAX_ITEMS)
+
+
+async def insert_many(table, values: list[dict]) -> list[int]:
+    # Call inside a transaction. SQLite gives a new row max(id) + 1 and only one transaction can write at a time,
+    # so the rows inserted here get consecutive ids ending at the new max(id).
+    await execute_many(table.insert(), values)
+    last_id = await database.fetch_val(sqlalchemy.select(sqlalchemy.func.max(table.c.id)))
+    return list(range(last_id - len(values) + 1, last_id + 1))
+
+
+# The IN lists below render one placeholder per id, so these queries are built per call rather than prepared
+async def find_post_ids(post_ids: list[int]) -> set[int]:
+    query = sqlalchemy.select(post_table.c.id).where(post_table.c.id.in_(set(post_ids)))
+    logger.debug(query)
+    return {row.id for row in await database.fetch_all(query)}
+
+
+def post_not_found(index: int) -> BulkItemResult:
+    return BulkItemResult(index=index, status_code=404, detail="Post not found")
+
+
+@router.post("/post/bulk", response_model=list[BulkItemResult])
+async def create_posts(
+        posts: Annotated[list[UserPostIn], BulkItems],
+        current_user: Annotated[User, Depends(get_current_user)],
+):
+    logger.info(f"Creating {len(posts)} posts")
+    values = [{**post.model_dump(), "user_id": current_user.id} for post in posts]
+    async with database.transaction():
+        ids = await insert_many(post_table, values)
+    posts_created([{**data, "id": post_id} for data, post_id in zip(values, ids)])
+    return [BulkItemResult(index=index, status_code=201, id=post_id) for index, post_id in enumerate(ids)]
+
+
+@router.post("/comment/bulk", response_model=list[BulkItemResult])
+async def create_comments(
+        comments: Annotated[list[CommentIn], BulkItems],
+        current_user: Annotated[User, Depends(get_current_user)],
+):
+    logger.info(f"Creating {len(comments)} comments")
+    existing = await find_post_ids([comment.post_id for comment in comments])
+    valid = [(index, comment) for index, comment in enumerate(comments) if comment.post_id in existing]
+    results = [post_not_found(index) for index, comment in enumerate(comments) if comment.post_id not in existing]
+    if valid:
+        values = [{**comment.model_dump(), "user_id": current_user.id} for _, comment in valid]
+        async with database.transaction():
+            ids = await insert_many(comment_table, values)
+            commented = {comment.post_id for _, comment in valid}
+            await execute_many(bump_post_version_statement.query, [{"post_id": post_id} for post_id in commented])
+        comments_created([comment.post_id for _, comment in valid])
+        results += [
+            BulkItemResult(index=index, status_code=201, id=comment_id) for (index, _), comment_id in zip(valid, ids)
+        ]
+    return sorted(results, key=lambda result: result.index)
+
+
+async def insert_likes(values: list[dict]) -> list[int]:
+    # Writes the likes and bumps the counters of the liked posts in one transaction
+    new_likes = collections.Counter(like["post_id"] for like in values)
+    async with database.transaction():
+        ids = await insert_many(like_table, values)
+        await execute_many(
+            post_table.update()
+            .where(post_table.c.id == sqlalchemy.bindparam("post_id"))
+            .values(
+                like_count=post_table.c.like_count + sqlalchemy.bindparam("new_likes"),
+                version=post_table.c.version + 1,
+            ),
+            [{"post_id": post_id, "new_likes": count} for post_id, count in new_likes.items()],
+        )
+        liked_posts = await database.fetch_all(select_post_and_likes.where(post_table.c.id.in_(list(new_likes))))
+    posts_liked([dict(post._mapping) for post in liked_posts])
+    return ids
+
+
+# With LIKE_BUFFER_ENABLED, like_post queues likes here instead of writing them itself. The lifespan starts and
+# stops the background flush.
+like_buffer = LikeBuffer(insert_likes, max_size=config.LIKE_BUFFER_MAX_SIZE, max_delay=config.LIKE_BUFFER_MAX_DELAY)
+metrics.register("like_buffer", like_buffer.stats)
+
+
+@router.post("/like/bulk", response_model=list[BulkItemResult])
+async def like_posts(
+        likes: Annotated[list[PostLikeIn], BulkItems],
+        current_user: Annotated[User, Depends(get_current_user)],
+):
+    logger.info(f"Liking {len(likes)} posts")
+    existing = await find_post_ids([like.post_id for like in likes])
+    valid = [(index, like) for index, like in enumerate(likes) if like.post_id in existing]
+    results = [post_not_found(index) for index, like in enumerate(likes) if like.post_id not in existing]
+    if valid:
+        ids = await insert_likes([{**like.model_dump(), "user_id": current_user.id} for _, like in valid])
+        results += [
+            BulkItemResult(index=index, status_code=201, id=like_id) for (index, _), like_id in zip(valid, ids)
+        ]
+    return sorted(results, key=lambda result: result.index)
+
 # await simply make sure that this function gets called and finishes running before continuing the execution of the current line
 # of code here. Remember that these async functions can sometimes be run in parallel but in this specific case you want to
 # actually wait for it to finish
@@ -1,8 +1,11 @@
+import asyncio
 import logging
+import os
 import tempfile
 import aiofiles
 from fastapi import APIRouter, HTTPException, UploadFile, status
-from storeapi.libs.b2 import b2_upload_file
+from storeapi.config import config
+from storeapi.libs.b2 import b2_stream_file, b2_upload_file, b2_uploader
 
 logger = logging.getLogger(__name__)
 
@@ -11,16 +14,42 @@ router = APIRouter()
 CHUNK_SIZE = 1024 * 1024
 
 
+# Without B2_UPLOAD_STREAMING the upload is saved to a temporary file first and the whole file is sent from there.
+# The file is removed once the b2_uploader thread is done with it, not when this coroutine ends: after a timeout
+# the thread keeps reading the file until its upload fails or finishes.
+async def save_and_upload_file(file: UploadFile) -> str:
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        filename = temp_file.name
+    try:
+        logger.info(f"Saving uploaded file temporarily to {filename}")
+        async with aiofiles.open(filename, "wb") as f:
+            while chunk := await file.read(CHUNK_SIZE):
+                await f.write(chunk)
+    except BaseException:
+        os.remove(filename)
+        raise
+    upload = asyncio.ensure_future(b2_uploader.run(b2_upload_file, filename, file.filename))
+    upload.add_done_callback(lambda _: os.remove(filename))
+    # Also marks the error of an upload nobody waits for anymore as seen, so asyncio doesn't log it
+    upload.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return await asyncio.shield(upload)
+
+
 @router.post("/upload", status_code=201)
 async def upload_file(file: UploadFile):
     try:
-        with tempfile.NamedTemporaryFile()as temp_file:
-            filename = temp_file.name
-            logger.info("Saving uploaded file temporarily to {filename}")
-            async with aiofiles.open(filename, "wb") as f:
-                while chunk := await file.read(CHUNK_SIZE):
-                    await f.write(chunk)
-            file_url = b2_upload_file(local_file=filename, file_name=file.filename)
+        # B2_UPLOAD_TIMEOUT is for the upload as a whole: reading the file, saving it if it isn't streamed and
+        # every call to B2
+        async with asyncio.timeout(config.B2_UPLOAD_TIMEOUT):
+            if config.B2_UPLOAD_STREAMING:
+                file_url = await b2_stream_file(file, file.filename, CHUNK_SIZE)
+            else:
+                file_url = await save_and_upload_file(file)
+    except TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Timed out uploading the file"
+        )
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
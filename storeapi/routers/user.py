@@ -1,26 +1,66 @@
 import logging
+import math
+import sqlalchemy
 from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Request
-from storeapi.database import database, user_table
+from storeapi import metrics
+from storeapi.config import config
+from storeapi.database import database, integrity_errors, user_table
 from storeapi.models.user import UserIn
-from storeapi.security import get_user, get_password_hash, authenticate_user, create_access_token, \
-    get_subject_for_token_type, create_confirmation_token
+from storeapi.security import get_password_hash, authenticate_user, create_access_token, \
+    get_subject_for_token_type, create_confirmation_token, invalidate_user, password_hasher
 from storeapi import tasks
+from storeapi.rate_limit import TokenBucketLimiter
+from storeapi.statements import Statement
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+insert_user_statement = Statement(user_table.insert(), column_keys=["email", "password"])
+confirm_user_statement = Statement(
+    user_table.update().where(user_table.c.email == sqlalchemy.bindparam("user_email")).values(confirmed=True)
+)
+
+
+# /token and /register run bcrypt, the most expensive thing we do, so they are limited per client IP and per
+# email, and refused outright while too many password checks are already waiting for the hasher
+ip_limiter = TokenBucketLimiter(config.AUTH_IP_RATE, config.AUTH_IP_BURST, config.RATE_LIMIT_MAX_KEYS)
+email_limiter = TokenBucketLimiter(config.AUTH_EMAIL_RATE, config.AUTH_EMAIL_BURST, config.RATE_LIMIT_MAX_KEYS)
+metrics.register("auth_rate_limit", lambda: {"ip": ip_limiter.stats(), "email": email_limiter.stats()})
+
+
+def admit_password_check(request: Request, email: str) -> None:
+    # Call before any hashing starts
+    if password_hasher.active + password_hasher.queued >= config.AUTH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    client_ip = request.client.host if request.client else "unknown"
+    for limiter, key in ((ip_limiter, client_ip), (email_limiter, email.lower())):
+        if retry_after := limiter.acquire(key):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
 @router.post("/register", status_code=201)
 async def register(user: UserIn, background_tasks: BackgroundTasks, request: Request):
-    if await get_user(user.email):
+    admit_password_check(request, user.email)
+    hashed_password = await password_hasher.run(get_password_hash, user.password)
+    query = insert_user_statement(email=user.email, password=hashed_password)
+    logger.debug(query)
+    # users.email is unique, so the insert itself tells us whether the email is taken
+    try:
+        await database.execute(query)
+    except integrity_errors as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="A user with this email already exists"
-        )
-    hashed_password = get_password_hash(user.password)
-    query = user_table.insert().values(email=user.email, password=hashed_password)
-    logger.debug(query)
-    await database.execute(query)
+        ) from e
     # confirmation_url = request.url_for("confirm_email", token=create_confirmation_token(user.email))
     background_tasks.add_task(tasks.send_user_registration_email, user.email,
                               confirmation_url=request.url_for("confirm_email", token=create_confirmation_token(user.email)),
@@ -30,7 +70,8 @@ async def register(user: UserIn, background_tasks: BackgroundTasks, request: Req
 
 
 @router.post("/token")
-async def login(user: UserIn):
+async def login(user: UserIn, request: Request):
+    admit_password_check(request, user.email)
     user = await authenticate_user(user.email, user.password)
     access_token = create_access_token(user.email)
     return {"access_token": access_token, "token_type": "bearer"}
@@ -39,9 +80,8 @@ async def login(user: UserIn):
 @router.get("/confirm/{token}")
 async def confirm_email(token: str):
     email = get_subject_for_token_type(token, "confirmation")
-    query = (
-        user_table.update().where(user_table.c.email == email).values(confirmed=True)
-    )
+    query = confirm_user_statement(user_email=email)
     logger.debug(query)
     await database.execute(query)
+    invalidate_user(email)
     return {"detail": "User confirmed"}
@@ -1,11 +1,20 @@
 import datetime
+import hashlib
 import logging
-from typing import Annotated, Literal
+import math
+import time
+from typing import Annotated, Callable, Literal
+import sqlalchemy
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import HTTPException, status
 from passlib.context import CryptContext
+from storeapi import metrics
+from storeapi.cache import LRUCache, VersionMap
+from storeapi.config import config
 from storeapi.database import database, user_table
+from storeapi.executor import BoundedExecutor
+from storeapi.statements import Statement
 from jose import jwt, ExpiredSignatureError, JWTError
 
 logger = logging.getLogger(__name__)
@@ -32,13 +41,32 @@ def confirm_token_expire_minutes() -> int:
     return 1440
 
 
-def get_subject_for_token_type(token: str, type: Literal["access", "confirmation"]) -> str:
+# Claims of tokens that passed verification, keyed by a hash of the token so the cache doesn't hold usable
+# tokens. A client sends the same access token with every request, so most requests skip jwt.decode. Entries
+# live until the token's exp and are checked against it again when read, so an expired token is never accepted.
+token_cache = LRUCache(max_size=config.TOKEN_CACHE_MAX_ENTRIES, ttl=0)
+metrics.register("token_cache", token_cache.stats)
+
+
+def decode_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is not None and payload["exp"] > time.time():
+        return payload
     try:
         payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
     except ExpiredSignatureError as e:
         raise create_credentials_exception("Token has expired") from e
     except JWTError as e:
         raise create_credentials_exception("Invalid token") from e
+    # Tokens without an exp are still accepted but not cached
+    if isinstance(payload.get("exp"), (int, float)) and payload["exp"] > time.time():
+        token_cache.set(key, payload, ttl=payload["exp"] - time.time())
+    return payload
+
+
+def get_subject_for_token_type(token: str, type: Literal["access", "confirmation"]) -> str:
+    payload = decode_token(token)
     email = payload.get("sub")
     if email is None:
         raise create_credentials_exception("Token is missing 'sub' field")
@@ -72,11 +100,84 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# Enough rounds that a hash takes a few milliseconds, long enough to time
+CALIBRATION_ROUNDS = 6
+
+
+def calibrate_bcrypt_rounds(
+        target_seconds: float, min_rounds: int, max_rounds: int, clock: Callable[[], float] = time.perf_counter
+) -> int:
+    # Time a cheap hash (best of 3) and scale up: every extra round doubles the time it takes. Timing at
+    # CALIBRATION_ROUNDS instead of min_rounds gives the same answer and keeps startup fast.
+    sample_rounds = min(min_rounds, CALIBRATION_ROUNDS)
+    bcrypt = pwd_context.handler("bcrypt").using(rounds=sample_rounds)
+    elapsed = math.inf
+    for _ in range(3):
+        start = clock()
+        bcrypt.hash("calibration")
+        elapsed = min(elapsed, clock() - start)
+    rounds = sample_rounds + round(math.log2(target_seconds / elapsed))
+    if rounds < min_rounds:
+        min_rounds_seconds = elapsed * 2 ** (min_rounds - sample_rounds)
+        logger.warning(
+            f"bcrypt with the minimum of {min_rounds} rounds takes about {min_rounds_seconds:.3f}s here, more than "
+            f"the {target_seconds}s target; hashing with {min_rounds} rounds"
+        )
+    return max(min_rounds, min(max_rounds, rounds))
+
+
+def configure_bcrypt_rounds(rounds: int) -> None:
+    # New hashes use `rounds`, and needs_update flags stored hashes with fewer rounds so they get rehashed.
+    # Hashes with more rounds are left alone: rehashing never lowers the cost of a password, and workers whose
+    # calibration came out a round apart don't keep rehashing each other's hashes.
+    pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds, bcrypt__max_rounds=None)
+
+
+def calibrate_password_hashing() -> int:
+    # Called once at startup, so the cost of a login matches the hardware we run on
+    rounds = calibrate_bcrypt_rounds(config.BCRYPT_TARGET_SECONDS, config.BCRYPT_MIN_ROUNDS, config.BCRYPT_MAX_ROUNDS)
+    configure_bcrypt_rounds(rounds)
+    logger.info(f"Hashing passwords with {rounds} bcrypt rounds")
+    return rounds
+
+
+# bcrypt takes a few hundred milliseconds on purpose. Async routes must run it here, e.g.
+# `await password_hasher.run(get_password_hash, password)`, otherwise every other request waits for it.
+password_hasher = BoundedExecutor("password-hasher", config.PASSWORD_HASH_WORKERS)
+metrics.register("password_hasher", password_hasher.stats)
+
+
+get_user_statement = Statement(user_table.select().where(user_table.c.email == sqlalchemy.bindparam("email")))
+update_password_statement = Statement(
+    user_table.update()
+    .where(user_table.c.email == sqlalchemy.bindparam("user_email"))
+    .values(password=sqlalchemy.bindparam("new_password"))
+)
+
+# User rows by email, so authenticated requests don't have to read the users table every time. Only users that
+# exist are cached: a registration doesn't have to invalidate anything. Code that updates a user must call
+# invalidate_user, and the TTL bounds how long a missed invalidation can go unnoticed.
+user_cache = LRUCache(max_size=config.USER_CACHE_MAX_ENTRIES, ttl=config.USER_CACHE_TTL)
+user_versions = VersionMap(max_entries=config.USER_CACHE_MAX_ENTRIES)
+metrics.register("user_cache", user_cache.stats)
+
+
+def invalidate_user(email: str) -> None:
+    user_versions.bump(email)
+    user_cache.invalidate(email)
+
+
 async def get_user(email: str):
+    if user := user_cache.get(email):
+        return user
     logger.debug("Fetching user from the database", extra={"email": email})
-    query = user_table.select().where(user_table.c.email == email)
+    # Like the response cache: don't cache a row if the user was updated while we were reading it
+    version = user_versions.get(email)
+    query = get_user_statement(email=email)
     result = await database.fetch_one(query)
     if result:
+        if user_versions.get(email) == version:
+            user_cache.set(email, result)
         return result
 
 
@@ -85,10 +186,16 @@ async def authenticate_user(email: str, password: str):
     user = await get_user(email)
     if not user:
         raise create_credentials_exception("Invalid email or password")
-    if not verify_password(password, user.password):
+    if not await password_hasher.run(verify_password, password, user.password):
         raise create_credentials_exception("Invalid email or password")
     if not user.confirmed:
         raise create_credentials_exception("User has not confirmed email")
+    # The password is at hand only now, so this is when a hash made with an outdated cost gets replaced
+    if pwd_context.needs_update(user.password):
+        logger.debug("Rehashing password", extra={"email": email})
+        hashed_password = await password_hasher.run(get_password_hash, password)
+        await database.execute(update_password_statement(user_email=email, new_password=hashed_password))
+        invalidate_user(email)
     return user
 
 
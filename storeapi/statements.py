@@ -0,0 +1,74 @@
+import logging
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# SQLAlchemy compiles a query to SQL every time it is executed, and for our feed and detail queries that costs
+# more than running them against SQLite. A Statement wraps a query written with named bindparams, compiles it
+# once per dialect and is then reused with new values on every call:
+#
+#     find_post_statement = Statement(post_table.select().where(post_table.c.id == sqlalchemy.bindparam("post_id")))
+#     await database.fetch_one(find_post_statement(post_id=1))
+#
+# Inserts are compiled for the columns in column_keys. Queries whose SQL changes with the values, like IN with a
+# list, can't be prepared this way.
+class Statement:
+    def __init__(self, query, column_keys: Optional[list[str]] = None):
+        self.query = query
+        self.column_keys = column_keys
+        self.compilations = 0
+        self._compiled = {}
+        self._sql = None
+
+    @property
+    def sql(self) -> str:
+        if self._sql is None:
+            self._sql = str(self.query.compile(column_keys=self.column_keys))
+        return self._sql
+
+    def __str__(self) -> str:
+        return self.sql
+
+    def compile(self, dialect=None, **kwargs):
+        compiled = self._compiled.get(dialect)
+        if compiled is None:
+            compiled = self.query.compile(dialect=dialect, column_keys=self.column_keys, **kwargs)
+            self._compiled[dialect] = compiled
+            self.compilations += 1
+        return compiled
+
+    def __call__(self, **values: Any) -> "BoundStatement":
+        return BoundStatement(self, values)
+
+
+class BoundStatement:
+    # What gets passed to database.fetch_*/execute: compiling it returns the cached compilation with our values
+    def __init__(self, statement: Statement, values: dict):
+        self.statement = statement
+        self.values = values
+
+    def __str__(self) -> str:
+        return self.statement.sql
+
+    def compile(self, dialect=None, **kwargs) -> "BoundCompiled":
+        return BoundCompiled(self.statement.compile(dialect=dialect, **kwargs), self.values)
+
+
+class BoundCompiled:
+    def __init__(self, compiled, values: dict):
+        self.compiled = compiled
+        self.values = values
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.compiled, name)
+
+    def __str__(self) -> str:
+        return self.compiled.string
+
+    @property
+    def params(self) -> dict:
+        return self.construct_params()
+
+    def construct_params(self, params=None, **kwargs) -> dict:
+        return self.compiled.construct_params({**self.values, **(params or {})}, **kwargs)
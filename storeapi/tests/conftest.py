@@ -4,14 +4,19 @@ from typing import AsyncGenerator, Generator
 from unittest.mock import Mock, AsyncMock
 
 import pytest  # Pytest is a testing framework for Python
+import sqlalchemy
 from fastapi.testclient import \
     TestClient  # TestClient allows interaction with the FastAPI app without starting the server
 from httpx import AsyncClient, ASGITransport, \
     Response, Request  # AsyncClient and ASGITransport are used to make async requests to our API
 
 os.environ["ENV_STATE"] = "test"
-from storeapi.database import database, user_table
+from storeapi.database import ProfiledConnection, ReadOnlyConnection, database, init_db, migrate, user_table
+from storeapi.db_routing import RoutedDatabase
 from storeapi.main import app  # Import the FastAPI app
+from storeapi.routers.post import response_cache
+from storeapi.routers.user import email_limiter, ip_limiter
+from storeapi.security import invalidate_user, token_cache, user_cache
 
 
 # Fixture to set the async backend to "asyncio" for the test session
@@ -20,6 +25,12 @@ def anyio_backend():
     return "asyncio"  # This ensures async functions run with asyncio during the entire test session
 
 
+# The app creates its tables in the lifespan, which the tests don't run, so create them once for the session
+@pytest.fixture(scope="session", autouse=True)
+def schema() -> None:
+    init_db()
+
+
 # Fixture to create a synchronous TestClient instance for interacting with the API
 @pytest.fixture()
 def client() -> Generator:
@@ -34,6 +45,38 @@ async def db() -> AsyncGenerator:
     await database.disconnect()
 
 
+# Every test starts with a fresh database, so responses and users cached by a previous test must not be served.
+# Rate limits start over too.
+@pytest.fixture(autouse=True)
+def clear_caches() -> Generator:
+    yield
+    response_cache.clear()
+    user_cache.clear()
+    token_cache.clear()
+    ip_limiter.clear()
+    email_limiter.clear()
+
+
+# The tests share one connection that rolls back (DB_FORCE_ROLL_BACK), which turns read/write routing off. Tests
+# that ask for this fixture run against a database file with routing on, like the app does outside of tests.
+# List it before the fixtures that create users, so they write to it too.
+@pytest.fixture()
+async def routed_database(tmp_path, mocker) -> AsyncGenerator:
+    url = f"sqlite:///{tmp_path / 'routed.db'}"
+    engine = sqlalchemy.create_engine(url, connect_args={"factory": ProfiledConnection})
+    with engine.begin() as connection:
+        migrate(connection)
+    engine.dispose()
+    routed = RoutedDatabase(
+        url, read_pool_size=2, read_options={"factory": ReadOnlyConnection}, factory=ProfiledConnection
+    )
+    await routed.connect()
+    for module in ("storeapi.tests.conftest", "storeapi.security", "storeapi.routers.post", "storeapi.routers.user"):
+        mocker.patch(f"{module}.database", routed)
+    yield routed
+    await routed.disconnect()
+
+
 # Fixture to create an asynchronous client for making async requests
 @pytest.fixture()
 async def async_client(client) -> AsyncGenerator:
@@ -59,6 +102,7 @@ async def confirmed_user(registered_user: dict) -> dict:
         .values(confirmed=True)
     )
     await database.execute(query)
+    invalidate_user(registered_user["email"])
     return registered_user
 
 
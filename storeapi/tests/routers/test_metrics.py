@@ -0,0 +1,10 @@
+import pytest
+from httpx import AsyncClient
+
+
+@pytest.mark.anyio
+async def test_get_metrics(async_client: AsyncClient):
+    await async_client.get("/post")
+    response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.json()["response_cache"]["misses"] >= 1
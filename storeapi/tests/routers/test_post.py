@@ -1,7 +1,15 @@
 from httpx import AsyncClient  # Import AsyncClient for making async HTTP requests
+import csv
+import io
+import json
+
 import pytest  # Import pytest for writing and running tests
 
 from storeapi import security
+from storeapi.database import database
+from storeapi.config import config
+from storeapi.routers import post as post_router
+from storeapi.routers.post import like_buffer, load_post_ranking, post_ranking, response_cache
 
 
 # Function to create a new post by sending an HTTP POST request to the "/post" endpoint
@@ -98,6 +106,32 @@ async def test_like_post(
     assert response.status_code == 201
 
 
+@pytest.mark.anyio
+async def test_like_post_updates_like_count(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 2
+
+
+@pytest.mark.anyio
+async def test_like_post_buffered(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str, mocker
+):
+    mocker.patch.object(config, "LIKE_BUFFER_ENABLED", True)
+    response = await async_client.post(
+        "/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 202
+    await like_buffer.flush()
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 1
+
+
 # Test to check if all posts can be retrieved
 @pytest.mark.anyio  # Marks this test as an async test using the anyio plugin
 async def test_get_all_posts(async_client: AsyncClient, created_post: dict):
@@ -107,7 +141,8 @@ async def test_get_all_posts(async_client: AsyncClient, created_post: dict):
     assert response.status_code == 200
     # Assert that the response JSON matches the created post
     # assert response.json() == [{**created_post, "likes": 0}]
-    assert created_post.items() <= response.json()[0].items()
+    assert created_post.items() <= response.json()["posts"][0].items()
+    assert response.json()["next_cursor"] is None
 
 
 @pytest.mark.anyio
@@ -130,7 +165,7 @@ async def test_get_all_posts_sorting(
     assert response.status_code == 200
     data = response.json()
 
-    post_ids = [post["id"] for post in data]
+    post_ids = [post["id"] for post in data["posts"]]
     assert post_ids == expected_orders
 
 
@@ -146,11 +181,75 @@ async def test_get_all_posts_sort_likes(
     assert response.status_code == 200
     data = response.json()
     expected_order = [2, 1]
-    post_ids = [post["id"] for post in data]
+    post_ids = [post["id"] for post in data["posts"]]
     expected_order = [1, 2]
     assert post_ids == expected_order
 
 
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "sorting, expected_pages",
+    [
+        ("new", [[3, 2], [1]]),
+        ("old", [[1, 2], [3]]),
+        ("most_likes", [[2, 3], [1]]),
+    ]
+)
+async def test_get_all_posts_pagination(
+        async_client: AsyncClient,
+        logged_in_token: str,
+        sorting: str,
+        expected_pages: list[list[int]]
+):
+    for body in ("Test Post 1", "Test Post 2", "Test Post 3"):
+        await create_post(body, async_client, logged_in_token)
+    await like_post(2, async_client, logged_in_token)
+
+    pages = []
+    params = {"sorting": sorting, "limit": 2}
+    while True:
+        response = await async_client.get("/post", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        pages.append([post["id"] for post in data["posts"]])
+        if data["next_cursor"] is None:
+            break
+        params["cursor"] = data["next_cursor"]
+
+    assert pages == expected_pages
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_invalid_cursor(async_client: AsyncClient):
+    response = await async_client.get("/post", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+@pytest.fixture()
+async def loaded_post_ranking():
+    await load_post_ranking()
+    yield post_ranking
+    post_ranking.clear()
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_sort_likes_from_ranking(
+        async_client: AsyncClient,
+        logged_in_token: str,
+        loaded_post_ranking,
+        mocker
+):
+    await create_post("Test Post 1", async_client, logged_in_token)
+    await create_post("Test Post 2", async_client, logged_in_token)
+    await like_post(1, async_client, logged_in_token)
+    fetch_all = mocker.spy(database, "fetch_all")
+    response = await async_client.get("/post", params={"sorting": "most_likes"})
+    assert response.status_code == 200
+    assert [post["id"] for post in response.json()["posts"]] == [1, 2]
+    assert response.json()["posts"][0]["likes"] == 1
+    fetch_all.assert_not_called()
+
+
 @pytest.mark.anyio
 async def test_get_all_posts_wrong_sorting(async_client: AsyncClient):
     response = await async_client.get("/post", params={"sorting": "wrong"})
@@ -179,6 +278,28 @@ async def test_create_comment(async_client: AsyncClient, created_post: dict, con
            }.items() <= response.json().items()
 
 
+# Test to check that commenting on a post that doesn't exist is rejected by the foreign key, without a lookup
+@pytest.mark.anyio
+async def test_create_comment_missing_post(async_client: AsyncClient, logged_in_token: str, mocker):
+    find_post = mocker.spy(post_router, "find_post")
+    response = await async_client.post(
+        "/comment",
+        json={"body": "Test Comment", "post_id": 2},
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    assert response.status_code == 404
+    find_post.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_like_missing_post(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/like", json={"post_id": 2}, headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    assert response.status_code == 404
+    assert await database.fetch_val("SELECT count(*) FROM likes") == 0
+
+
 # Test to check if comments on a post can be retrieved
 @pytest.mark.anyio  # Marks this test as an async test using the anyio plugin
 async def test_get_comments_on_post(
@@ -221,6 +342,130 @@ async def test_get_post_with_comments(
     }
 
 
+@pytest.mark.anyio
+async def test_get_post_with_comments_cached(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.headers["x-cache"] == "MISS"
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.headers["x-cache"] == "HIT"
+
+    comment = await create_comment("Test Comment", created_post["id"], async_client, logged_in_token)
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.headers["x-cache"] == "MISS"
+    assert response.json()["comments"] == [comment]
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.headers["x-cache"] == "MISS"
+    assert response.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cache_invalidated_by_writes(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get("/post")
+    response = await async_client.get("/post")
+    assert response.headers["x-cache"] == "HIT"
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.get("/post")
+    assert response.headers["x-cache"] == "MISS"
+    assert response.json()["posts"][0]["likes"] == 1
+
+    await create_post("Test Post 2", async_client, logged_in_token)
+    response = await async_client.get("/post")
+    assert [post["id"] for post in response.json()["posts"]] == [2, 1]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_not_cached_when_written_during_read(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str, mocker
+):
+    fetch_all = database.fetch_all
+
+    async def fetch_all_then_like(query, values=None):
+        # The read has its rows when a like commits, and finishes after it
+        rows = await fetch_all(query, values)
+        await like_post(created_post["id"], async_client, logged_in_token)
+        return rows
+
+    mocker.patch.object(post_router.database, "fetch_all", side_effect=fetch_all_then_like)
+    response = await async_client.get("/post")
+    assert response.json()["posts"][0]["likes"] == 0
+    mocker.stopall()
+    response = await async_client.get("/post")
+    assert response.headers["x-cache"] == "MISS"
+    assert response.json()["posts"][0]["likes"] == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/post/{post_id}", "/post/{post_id}/comment"])
+async def test_get_post_not_modified(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str, path: str, mocker
+):
+    url = path.format(post_id=created_post["id"])
+    response = await async_client.get(url)
+    etag = response.headers["etag"]
+
+    response_cache_get = mocker.spy(response_cache, "get")
+    response = await async_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    response_cache_get.assert_not_called()
+
+    await create_comment("Test Comment", created_post["id"], async_client, logged_in_token)
+    response = await async_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path, get_comments", [
+    ("/post/{post_id}", lambda data: data["comments"]),
+    ("/post/{post_id}/comment", lambda data: data),
+])
+async def test_get_comments_pagination(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str, path: str, get_comments
+):
+    for body in ("Comment 1", "Comment 2", "Comment 3"):
+        await create_comment(body, created_post["id"], async_client, logged_in_token)
+    url = path.format(post_id=created_post["id"])
+
+    response = await async_client.get(url, params={"limit": 2})
+    assert [comment["id"] for comment in get_comments(response.json())] == [1, 2]
+    response = await async_client.get(url, params={"limit": 2, "after_id": 2})
+    assert [comment["id"] for comment in get_comments(response.json())] == [3]
+    response = await async_client.get(url, params={"limit": 2, "after_id": 3})
+    assert get_comments(response.json()) == []
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/post/{post_id}", "/post/{post_id}/comment"])
+async def test_get_post_sees_writes_from_other_workers(
+        async_client: AsyncClient, created_post: dict, confirmed_user: dict, path: str
+):
+    url = path.format(post_id=created_post["id"])
+    response = await async_client.get(url)
+    etag = response.headers["etag"]
+    await async_client.get(url)  # Now cached
+
+    # Another worker writes a comment: it goes to the database, but none of this worker's in-memory state knows
+    async with database.transaction():
+        await database.execute(post_router.insert_comment_statement(
+            body="From another worker", post_id=created_post["id"], user_id=confirmed_user["id"]
+        ))
+        await database.execute(post_router.bump_post_version_statement(post_id=created_post["id"]))
+
+    response = await async_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.headers["x-cache"] == "MISS"
+    assert "From another worker" in response.text
+
+
 # Test to check if a request for a non-existent post returns a 404 error
 @pytest.mark.anyio  # Marks this test as an async test using the anyio plugin
 async def test_get_missing_post_with_comments(
@@ -230,3 +475,147 @@ async def test_get_missing_post_with_comments(
     response = await async_client.get(f"/post/2")
     # Assert that the response status code is 404 (Not Found), indicating that the post was not found
     assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_export_posts_ndjson(
+        async_client: AsyncClient, created_post: dict, created_comment: dict, logged_in_token: str
+):
+    await create_post("Test Post 2", async_client, logged_in_token)
+    response = await async_client.get("/post/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0] == {"post": {**created_post, "likes": 0}, "comments": [created_comment]}
+    assert lines[1]["post"]["id"] == 2
+    assert lines[1]["comments"] == []
+
+
+@pytest.mark.anyio
+async def test_export_posts_csv(
+        async_client: AsyncClient, created_post: dict, created_comment: dict
+):
+    response = await async_client.get("/post/export", params={"format": "csv"})
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 1
+    assert rows[0]["body"] == created_post["body"]
+    assert rows[0]["comment_body"] == created_comment["body"]
+
+
+@pytest.mark.anyio
+async def test_export_posts_csv_empty(async_client: AsyncClient):
+    response = await async_client.get("/post/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.text.splitlines() == [
+        "id,body,user_id,image_url,likes,comment_id,comment_body,comment_user_id"
+    ]
+
+
+@pytest.mark.anyio
+async def test_create_posts_bulk(async_client: AsyncClient, confirmed_user: dict, logged_in_token: str):
+    response = await async_client.post(
+        "/post/bulk",
+        json=[{"body": "Test Post 1"}, {"body": "Test Post 2"}],
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 200
+    assert [(result["status_code"], result["id"]) for result in response.json()] == [(201, 1), (201, 2)]
+    response = await async_client.get("/post", params={"sorting": "old"})
+    assert [post["body"] for post in response.json()["posts"]] == ["Test Post 1", "Test Post 2"]
+
+
+@pytest.mark.anyio
+async def test_create_comments_bulk_reports_missing_post(
+        async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.post(
+        "/comment/bulk",
+        json=[
+            {"body": "Comment 1", "post_id": created_post["id"]},
+            {"body": "Comment 2", "post_id": 999},
+            {"body": "Comment 3", "post_id": created_post["id"]},
+        ],
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 200
+    assert [(result["index"], result["status_code"], result["id"]) for result in response.json()] == [
+        (0, 201, 1), (1, 404, None), (2, 201, 2)
+    ]
+    response = await async_client.get(f"/post/{created_post['id']}/comment")
+    assert [comment["body"] for comment in response.json()] == ["Comment 1", "Comment 3"]
+
+
+@pytest.mark.anyio
+async def test_like_posts_bulk(async_client: AsyncClient, logged_in_token: str):
+    await create_post("Test Post 1", async_client, logged_in_token)
+    await create_post("Test Post 2", async_client, logged_in_token)
+    response = await async_client.post(
+        "/like/bulk",
+        json=[{"post_id": 2}, {"post_id": 2}, {"post_id": 1}, {"post_id": 3}],
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 200
+    assert [result["status_code"] for result in response.json()] == [201, 201, 201, 404]
+    response = await async_client.get("/post", params={"sorting": "most_likes"})
+    assert [(post["id"], post["likes"]) for post in response.json()["posts"]] == [(2, 2), (1, 1)]
+
+
+@pytest.mark.anyio
+async def test_bulk_rejects_empty_batch(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/post/bulk", json=[], headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_search_posts(async_client: AsyncClient, logged_in_token: str):
+    await create_post("The quick brown fox", async_client, logged_in_token)
+    await create_post("A lazy dog", async_client, logged_in_token)
+    await create_post("Fox and dog, fox and dog", async_client, logged_in_token)
+    response = await async_client.get("/post/search", params={"q": "fox"})
+    assert response.status_code == 200
+    assert [post["id"] for post in response.json()["posts"]] == [3, 1]
+    assert response.json()["posts"][0]["likes"] == 0
+
+
+@pytest.mark.anyio
+async def test_search_posts_pagination(async_client: AsyncClient, logged_in_token: str):
+    for number in range(3):
+        await create_post(f"Fox number {number}", async_client, logged_in_token)
+    response = await async_client.get("/post/search", params={"q": "fox", "limit": 2})
+    data = response.json()
+    assert len(data["posts"]) == 2
+    response = await async_client.get("/post/search", params={"q": "fox", "limit": 2, "cursor": data["next_cursor"]})
+    assert len(response.json()["posts"]) == 1
+    assert response.json()["next_cursor"] is None
+
+
+@pytest.mark.anyio
+async def test_search_posts_query_syntax_is_escaped(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get("/post/search", params={"q": 'post" OR (NEAR'})
+    assert response.status_code == 200
+    assert response.json()["posts"] == []
+
+
+@pytest.mark.anyio
+async def test_routes_with_read_write_routing(
+        routed_database, async_client: AsyncClient, logged_in_token: str
+):
+    post = await create_post("Routed Post", async_client, logged_in_token)
+    comment = await create_comment("Routed Comment", post["id"], async_client, logged_in_token)
+    await like_post(post["id"], async_client, logged_in_token)
+    response = await async_client.get("/post")
+    assert response.status_code == 200
+    assert [(p["id"], p["likes"]) for p in response.json()["posts"]] == [(post["id"], 1)]
+    response = await async_client.get(f"/post/{post['id']}")
+    assert response.json()["comments"] == [comment]
+    response = await async_client.get("/post/export")
+    assert [json.loads(line)["post"]["id"] for line in response.text.splitlines()] == [post["id"]]
+    stats = routed_database.stats()
+    assert stats["routing"]
+    assert stats["writer"]["count"] > 0
+    assert stats["read_pool"]["count"] > 0
+    assert stats["read_pool"]["available"] == 2
+    assert stats["read_pool"]["dedicated"] == 0
@@ -1,10 +1,13 @@
+import asyncio
 import contextlib
 import os
 import pathlib
 import tempfile
+import time
 import pytest
 from httpx import AsyncClient
 import tempfile
+from storeapi.config import config
 
 
 @pytest.fixture()
@@ -21,6 +24,12 @@ def mock_b2_upload_file(mocker):
     )
 
 
+# Most of these tests are for uploads saved to a temporary file first, the streamed ones turn it back on
+@pytest.fixture(autouse=True)
+def temp_file_uploads(mocker):
+    mocker.patch.object(config, "B2_UPLOAD_STREAMING", False)
+
+
 @pytest.fixture(autouse=True)
 def aiofiles_mock_open(mocker, fs):
     mock_open = mocker.patch("aiofiles.open")
@@ -67,3 +76,107 @@ async def test_temp_file_removed_after_upload(
 
     created_temp_file = named_temp_file_spy.spy_return
     assert not os.path.exists(created_temp_file.name)
+
+
+def slow_b2_upload_file(seconds: float):
+    # Stands in for B2: reads the file like the real upload would and takes `seconds` to send it
+    def upload(local_file: str, file_name: str) -> str:
+        with open(local_file, "rb") as f:
+            f.read()
+        time.sleep(seconds)
+        return "https://fakeurl.com"
+    return upload
+
+
+@pytest.mark.anyio
+async def test_get_post_latency_while_uploading(
+        async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mocker
+):
+    # The upload runs on the b2_uploader threads, so the event loop keeps serving other routes. Run inline, it
+    # would stall every GET /post for the whole upload.
+    mocker.patch("storeapi.routers.upload.b2_upload_file", side_effect=slow_b2_upload_file(0.5))
+    upload = asyncio.create_task(call_upload_endpoint(async_client, logged_in_token, sample_image))
+    latencies = []
+    while not upload.done():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        assert (await async_client.get("/post")).status_code == 200
+        latencies.append(time.perf_counter() - start - 0.01)
+    assert upload.result().status_code == 201
+    assert len(latencies) > 1
+    assert max(latencies) < 0.25
+
+
+@pytest.mark.anyio
+async def test_upload_timeout(
+        async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mocker
+):
+    mocker.patch("storeapi.routers.upload.b2_upload_file", side_effect=slow_b2_upload_file(0.3))
+    mocker.patch.object(config, "B2_UPLOAD_TIMEOUT", 0.05)
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+    assert response.status_code == 504
+
+
+@pytest.mark.anyio
+async def test_temp_file_kept_until_timed_out_upload_finishes(
+        async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mocker
+):
+    # The timeout gives up on the upload, but the b2_uploader thread still has to read the file
+    uploaded = []
+
+    def late_reading_upload(local_file: str, file_name: str) -> str:
+        time.sleep(0.2)
+        with open(local_file, "rb") as f:
+            uploaded.append(f.read())
+        return "https://fakeurl.com"
+
+    mocker.patch("storeapi.routers.upload.b2_upload_file", side_effect=late_reading_upload)
+    mocker.patch.object(config, "B2_UPLOAD_TIMEOUT", 0.05)
+    named_temp_file_spy = mocker.spy(tempfile, "NamedTemporaryFile")
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+    assert response.status_code == 504
+
+    created_temp_file = named_temp_file_spy.spy_return
+    assert os.path.exists(created_temp_file.name)
+    while not uploaded:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    assert uploaded == [sample_image.read_bytes()]
+    assert not os.path.exists(created_temp_file.name)
+
+
+@pytest.mark.anyio
+async def test_streamed_upload_timeout(
+        async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mocker
+):
+    async def slow_b2_stream_file(file, file_name: str, chunk_size: int) -> str:
+        await asyncio.sleep(0.3)
+        return "https://fakeurl.com"
+
+    mocker.patch.object(config, "B2_UPLOAD_STREAMING", True)
+    mocker.patch("storeapi.routers.upload.b2_stream_file", side_effect=slow_b2_stream_file)
+    mocker.patch.object(config, "B2_UPLOAD_TIMEOUT", 0.05)
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+    assert response.status_code == 504
+
+
+@pytest.mark.anyio
+async def test_streamed_upload_skips_temp_file(
+        async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mocker
+):
+    mocker.patch.object(config, "B2_UPLOAD_STREAMING", True)
+    sample_image.write_bytes(b"x" * 2_500_000)  # A few chunks
+    named_temp_file_spy = mocker.spy(tempfile, "NamedTemporaryFile")
+    received = []
+
+    async def b2_stream_file(file, file_name: str, chunk_size: int) -> str:
+        while chunk := await file.read(chunk_size):
+            received.append(chunk)
+        return "https://fakeurl.com"
+
+    mocker.patch("storeapi.routers.upload.b2_stream_file", side_effect=b2_stream_file)
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+    assert response.status_code == 201
+    assert response.json()["file_url"] == "https://fakeurl.com"
+    assert b"".join(received) == sample_image.read_bytes()
+    named_temp_file_spy.assert_not_called()
@@ -1,8 +1,14 @@
+import asyncio
+import time
+
 import pytest
 from httpx import AsyncClient
 
 from fastapi import BackgroundTasks
 
+from storeapi import security
+from storeapi.routers import user as user_router
+
 
 async def register_user(async_client: AsyncClient, email: str, password: str):
     return await async_client.post(
@@ -34,6 +40,18 @@ async def test_confirm_user(async_client: AsyncClient, mocker):
     assert "User confirmed" in response.json()["detail"]
 
 
+@pytest.mark.anyio
+async def test_login_after_confirm_user(async_client: AsyncClient, mocker):
+    # The failed login caches the unconfirmed user, confirming must invalidate it
+    spy = mocker.spy(BackgroundTasks, "add_task")
+    await register_user(async_client, "test@example.net", "1234")
+    user_details = {"email": "test@example.net", "password": "1234"}
+    assert (await async_client.post("/token", json=user_details)).status_code == 401
+    await async_client.get(str(spy.call_args[1]["confirmation_url"]))
+    response = await async_client.post("/token", json=user_details)
+    assert response.status_code == 200
+
+
 @pytest.mark.anyio
 async def test_confirm_your_invalid_token(async_client: AsyncClient):
     response = await async_client.get("/confirm/invalid_token")
@@ -84,3 +102,44 @@ async def test_login_user(
                         },
     )
     assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_get_post_latency_while_logging_in(async_client: AsyncClient, confirmed_user: dict):
+    # Password checks run on the password_hasher threads, so the event loop keeps serving other routes while
+    # logins are in flight. Run inline, every login would stall a GET /post for at least a whole bcrypt check.
+    start = time.perf_counter()
+    security.verify_password(confirmed_user["password"], security.get_password_hash(confirmed_user["password"]))
+    bcrypt_seconds = (time.perf_counter() - start) / 2
+    user_details = {"email": confirmed_user["email"], "password": confirmed_user["password"]}
+    logins = [asyncio.create_task(async_client.post("/token", json=user_details)) for _ in range(8)]
+    latencies = []
+    while not all(login.done() for login in logins):
+        # A GET /post that arrives every 10 ms: measured from when it arrives, so time spent waiting for the
+        # event loop to get to it counts too
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        assert (await async_client.get("/post")).status_code == 200
+        latencies.append(time.perf_counter() - start - 0.01)
+    assert all(login.result().status_code == 200 for login in logins)
+    assert len(latencies) > 1
+    assert max(latencies) < bcrypt_seconds
+
+
+@pytest.mark.anyio
+async def test_login_rate_limited_per_email(async_client: AsyncClient, mocker):
+    mocker.patch.object(user_router.email_limiter, "burst", 2)
+    user_details = {"email": "test@example.net", "password": "1234"}
+    for _ in range(2):
+        assert (await async_client.post("/token", json=user_details)).status_code == 401
+    response = await async_client.post("/token", json=user_details)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+@pytest.mark.anyio
+async def test_login_refused_while_hasher_is_busy(async_client: AsyncClient, mocker):
+    mocker.patch.object(security.password_hasher, "queued", user_router.config.AUTH_MAX_PENDING)
+    response = await async_client.post("/token", json={"email": "test@example.net", "password": "1234"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
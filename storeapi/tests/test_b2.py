@@ -0,0 +1,123 @@
+import asyncio
+import io
+import threading
+import time
+
+import b2sdk.v2 as b2
+import pytest
+
+from storeapi.libs import b2 as storeapi_b2
+from storeapi.libs.b2 import B2StreamingUpload, b2_stream_file
+
+
+# B2 as simulated by b2sdk, in memory. It accepts parts of 200 bytes and up.
+@pytest.fixture()
+def bucket(mocker) -> b2.Bucket:
+    api = b2.B2Api(b2.InMemoryAccountInfo(), api_config=b2.B2HttpApiConfig(_raw_api_class=b2.RawSimulator))
+    key_id, key = api.session.raw_api.create_account()
+    api.authorize_account("production", key_id, key)
+    bucket = api.create_bucket("bucket", "allPrivate")
+    mocker.patch("storeapi.libs.b2.b2_api", return_value=api)
+    mocker.patch("storeapi.libs.b2.b2_get_bucket", return_value=bucket)
+    return bucket
+
+
+class ChunkReader:
+    def __init__(self, data: bytes):
+        self.file = io.BytesIO(data)
+
+    async def read(self, size: int) -> bytes:
+        return self.file.read(size)
+
+
+def downloaded(bucket: b2.Bucket, file_url: str) -> bytes:
+    out = io.BytesIO()
+    bucket.download_file_by_id(file_url.split("fileId=")[1]).save(out)
+    return out.getvalue()
+
+
+async def stream(data: bytes, part_size: int = 200, max_parts_in_flight: int = 2) -> tuple[B2StreamingUpload, str]:
+    upload = B2StreamingUpload("file.bin", part_size, max_parts_in_flight)
+    reader = ChunkReader(data)
+    while chunk := await reader.read(75):
+        await upload.write(chunk)
+    return upload, await upload.finish()
+
+
+@pytest.mark.anyio
+async def test_small_file_uploaded_in_one_go(bucket):
+    data = b"x" * 150
+    upload, file_url = await stream(data)
+    assert upload.file_id is None
+    assert downloaded(bucket, file_url) == data
+
+
+@pytest.mark.anyio
+async def test_file_of_exactly_one_part_uploaded_in_one_go(bucket):
+    upload, file_url = await stream(b"x" * 200)
+    assert upload.file_id is None
+    assert downloaded(bucket, file_url) == b"x" * 200
+
+
+@pytest.mark.anyio
+async def test_large_file_uploaded_in_parts(bucket):
+    data = bytes(range(256)) * 4 + b"end"
+    upload, file_url = await stream(data)
+    assert len(upload._parts) == 6
+    assert downloaded(bucket, file_url) == data
+
+
+@pytest.mark.anyio
+async def test_parts_in_flight_are_bounded(bucket, mocker):
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+    upload_part = storeapi_b2.b2_upload_part
+
+    def slow_upload_part(*args):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.02)
+        with lock:
+            in_flight -= 1
+        return upload_part(*args)
+
+    mocker.patch("storeapi.libs.b2.b2_upload_part", side_effect=slow_upload_part)
+    data = b"x" * 2000
+    _, file_url = await stream(data, max_parts_in_flight=3)
+    assert max_in_flight == 3
+    assert downloaded(bucket, file_url) == data
+
+
+@pytest.mark.anyio
+async def test_failed_part_cancels_large_file(bucket, mocker):
+    mocker.patch("storeapi.libs.b2.config.B2_UPLOAD_PART_SIZE", 200)
+    upload_part = storeapi_b2.b2_upload_part
+
+    def failing_upload_part(api, file_id, part_number, data):
+        if part_number == 2:
+            raise ConnectionError("B2 went away")
+        return upload_part(api, file_id, part_number, data)
+
+    mocker.patch("storeapi.libs.b2.b2_upload_part", side_effect=failing_upload_part)
+    with pytest.raises(ConnectionError):
+        await b2_stream_file(ChunkReader(b"x" * 2000), "file.bin", 75)
+    assert list(bucket.list_unfinished_large_files()) == []
+
+
+class TricklingReader(ChunkReader):
+    # A client that sends its body a little at a time
+    async def read(self, size: int) -> bytes:
+        await asyncio.sleep(0.02)
+        return await super().read(size)
+
+
+@pytest.mark.anyio
+async def test_timed_out_upload_cancels_large_file(bucket, mocker):
+    mocker.patch("storeapi.libs.b2.config.B2_UPLOAD_PART_SIZE", 200)
+    with pytest.raises(TimeoutError):
+        async with asyncio.timeout(0.2):
+            await b2_stream_file(TricklingReader(b"x" * 2000), "file.bin", 75)
+    assert list(bucket.list_unfinished_large_files()) == []
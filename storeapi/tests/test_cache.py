@@ -0,0 +1,75 @@
+from storeapi.cache import LRUCache, VersionMap
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_get_and_set():
+    cache = LRUCache(max_size=10, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire():
+    clock = FakeClock()
+    cache = LRUCache(max_size=10, ttl=60, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=120)
+    clock.now = 61
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.stats()["expirations"] == 1
+
+
+def test_evicts_least_recently_used_by_size():
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set("a", b"aaaa", size=4)
+    cache.set("b", b"bbbb", size=4)
+    cache.get("a")
+    cache.set("c", b"cccc", size=4)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.size == 8
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entry_larger_than_cache_is_not_stored():
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set("a", b"a" * 11, size=11)
+    assert len(cache) == 0
+
+
+def test_invalidate_tag():
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set("a", 1, tags=["x"])
+    cache.set("b", 2, tags=["x", "y"])
+    cache.set("c", 3, tags=["y"])
+    cache.invalidate_tag("x")
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_version_map_bump():
+    versions = VersionMap(max_entries=10)
+    etag = versions.etag(1)
+    assert versions.bump(1) == 1
+    assert versions.etag(1) != etag
+    assert versions.get(2) == 0
+
+
+def test_version_map_eviction_never_reuses_version():
+    versions = VersionMap(max_entries=1)
+    versions.bump(1)
+    versions.bump(1)
+    versions.bump(2)
+    # 1 was evicted at version 2, it must not go back to an earlier version
+    assert versions.get(1) > 2
@@ -0,0 +1,135 @@
+import sqlite3
+import types
+
+import pytest
+
+import sqlalchemy
+
+from storeapi import database as database_module
+from storeapi.config import config
+from storeapi.database import (
+    database,
+    engine,
+    like_table,
+    metadata,
+    post_table,
+    post_search_table,
+    user_table,
+    reconcile_like_counts,
+    rebuild_post_search,
+)
+from storeapi.routers import post as post_router
+from storeapi.statements import BoundStatement
+
+
+@pytest.mark.anyio
+async def test_reconcile_like_counts(registered_user: dict):
+    post_id = await database.execute(post_table.insert().values(body="Test Post", user_id=registered_user["id"]))
+    # Insert likes directly so the counter on the post isn't updated
+    for _ in range(2):
+        await database.execute(like_table.insert().values(post_id=post_id, user_id=registered_user["id"]))
+
+    assert await reconcile_like_counts() == 1
+    post = await database.fetch_one(post_table.select().where(post_table.c.id == post_id))
+    assert post.like_count == 2
+    assert await reconcile_like_counts() == 0
+
+
+@pytest.mark.anyio
+async def test_post_search_index_follows_posts(registered_user: dict):
+    query = sqlalchemy.select(post_search_table.c.rowid).where(
+        sqlalchemy.literal_column("posts_fts").op("MATCH")("searchable")
+    )
+    post_id = await database.execute(post_table.insert().values(body="searchable", user_id=registered_user["id"]))
+    assert await database.fetch_val(query) == post_id
+
+    await database.execute(post_table.update().where(post_table.c.id == post_id).values(body="changed"))
+    assert await database.fetch_val(query) is None
+
+    await rebuild_post_search()
+    assert await database.fetch_val(query) is None
+
+
+def query_plan(query) -> list[str]:
+    if isinstance(query, BoundStatement):
+        query = query.statement.query.params(**query.values)
+    compiled = query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        return [row.detail for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")]
+
+
+def assert_no_table_scan(plan: list[str], sorted_by_index: bool = True):
+    tables = set(metadata.tables)
+    for detail in plan:
+        words = detail.split()
+        assert not (words[0] == "SCAN" and words[1] in tables and "USING" not in words), plan
+    if sorted_by_index:
+        assert not any("TEMP B-TREE" in detail for detail in plan), plan
+
+
+# The first page of the new and old feeds walks the posts table in rowid order and stops after LIMIT rows,
+# which SQLite reports as a plain SCAN, so only pages after a cursor are checked for those.
+@pytest.mark.parametrize(
+    "query",
+    [
+        post_router.build_feed_query(post_router.PostSorting.new, 20, {"id": 50, "likes": 0}),
+        post_router.build_feed_query(post_router.PostSorting.old, 20, {"id": 50, "likes": 0}),
+        post_router.build_feed_query(post_router.PostSorting.most_likes, 20),
+        post_router.build_feed_query(post_router.PostSorting.most_likes, 20, {"id": 50, "likes": 3}),
+        post_router.build_comments_query(1, 20),
+        post_router.build_comments_query(1, 20, after_id=50),
+        post_table.select().where(post_table.c.id == 1),
+        user_table.select().where(user_table.c.email == "test@example.net"),
+        sqlalchemy.select(post_table.c.id).where(post_table.c.id.in_([1, 2])),
+        post_table.update().where(post_table.c.id == 1).values(like_count=post_table.c.like_count + 1),
+    ],
+)
+def test_hot_path_query_uses_index(query):
+    assert_no_table_scan(query_plan(query))
+
+
+# These sort a small, already filtered set of rows in memory
+@pytest.mark.parametrize(
+    "query",
+    [
+        post_router.build_post_with_comments_query(1, 20),
+        post_router.build_search_query('"test"', 20),
+    ],
+)
+def test_lookup_query_uses_index(query):
+    assert_no_table_scan(query_plan(query), sorted_by_index=False)
+
+
+def test_declared_indexes_exist():
+    inspector = sqlalchemy.inspect(engine)
+    for table in metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= existing
+
+
+@pytest.mark.anyio
+async def test_sqlite_profile_applied_to_every_connection():
+    pragmas = ["journal_mode", "mmap_size", "cache_size", "busy_timeout", "foreign_keys"]
+    expected = [
+        config.SQLITE_JOURNAL_MODE.lower(),
+        config.SQLITE_MMAP_SIZE,
+        config.SQLITE_CACHE_SIZE,
+        config.SQLITE_BUSY_TIMEOUT,
+        1,
+    ]
+    with engine.connect() as connection:
+        assert [connection.exec_driver_sql(f"PRAGMA {pragma}").scalar() for pragma in pragmas] == expected
+    assert [await database.fetch_val(f"PRAGMA {pragma}") for pragma in pragmas] == expected
+
+
+def test_integrity_errors_of_the_configured_driver(mocker):
+    assert database_module.driver_integrity_errors() == (sqlite3.IntegrityError,)
+
+    class IntegrityConstraintViolationError(Exception):
+        pass
+
+    asyncpg = types.ModuleType("asyncpg")
+    asyncpg.IntegrityConstraintViolationError = IntegrityConstraintViolationError
+    mocker.patch.dict("sys.modules", {"asyncpg": asyncpg})
+    mocker.patch.object(database_module, "is_sqlite", False)
+    assert IntegrityConstraintViolationError in database_module.driver_integrity_errors()
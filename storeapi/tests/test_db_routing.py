@@ -0,0 +1,149 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from storeapi.database import ProfiledConnection, ReadOnlyConnection
+from storeapi.db_routing import RoutedDatabase
+
+
+async def open_routed_database(tmp_path, **options) -> RoutedDatabase:
+    url = f"sqlite:///{tmp_path / 'routed.db'}"
+    database = RoutedDatabase(
+        url, read_pool_size=2, read_options={"factory": ReadOnlyConnection}, factory=ProfiledConnection, **options
+    )
+    await database.connect()
+    await database.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, body TEXT NOT NULL)")
+    return database
+
+
+@pytest.fixture()
+async def routed_database(tmp_path):
+    database = await open_routed_database(tmp_path)
+    yield database
+    await database.disconnect()
+
+
+@pytest.fixture()
+async def group_commit_database(tmp_path):
+    database = await open_routed_database(tmp_path, group_commit_window=0.01)
+    yield database
+    await database.disconnect()
+
+
+@pytest.mark.anyio
+async def test_concurrent_reads_and_writes(routed_database: RoutedDatabase):
+    async def write(i: int):
+        return await routed_database.execute(f"INSERT INTO posts (body) VALUES ('Post {i}')")
+
+    async def read():
+        return await routed_database.fetch_val("SELECT count(*) FROM posts")
+
+    results = await asyncio.gather(*[write(i) for i in range(50)], *[read() for _ in range(50)])
+    assert sorted(results[:50]) == list(range(1, 51))
+    assert await read() == 50
+    stats = routed_database.stats()
+    assert stats["writer"]["count"] == 51
+    assert stats["read_pool"]["count"] == 51
+    assert stats["read_pool"]["available"] == 2
+
+
+@pytest.mark.anyio
+async def test_transaction_reads_its_own_writes(routed_database: RoutedDatabase):
+    async with routed_database.transaction():
+        await routed_database.execute("INSERT INTO posts (body) VALUES ('Post')")
+        assert await routed_database.fetch_val("SELECT count(*) FROM posts") == 1
+    assert await routed_database.fetch_val("SELECT count(*) FROM posts") == 1
+
+
+@pytest.mark.anyio
+async def test_transaction_rolls_back(routed_database: RoutedDatabase):
+    with pytest.raises(ValueError):
+        async with routed_database.transaction():
+            await routed_database.execute("INSERT INTO posts (body) VALUES ('Post')")
+            raise ValueError()
+    assert await routed_database.fetch_val("SELECT count(*) FROM posts") == 0
+    # The writer was released
+    assert await routed_database.execute("INSERT INTO posts (body) VALUES ('Post')") == 1
+
+
+@pytest.mark.anyio
+async def test_read_pool_is_read_only(routed_database: RoutedDatabase):
+    async with routed_database.read_pool.connection() as connection:
+        with pytest.raises(sqlite3.OperationalError):
+            await connection.execute("INSERT INTO posts (body) VALUES ('Post')")
+
+
+@pytest.mark.anyio
+async def test_group_commit_returns_each_writes_id(group_commit_database: RoutedDatabase):
+    ids = await asyncio.gather(
+        *[group_commit_database.execute(f"INSERT INTO posts (body) VALUES ('Post {i}')") for i in range(50)]
+    )
+    assert sorted(ids) == list(range(1, 51))
+    for post_id in ids[:5]:
+        body = await group_commit_database.fetch_val(f"SELECT body FROM posts WHERE id = {post_id}")
+        assert body == f"Post {post_id - 1}"
+    stats = group_commit_database.stats()["writer"]
+    assert stats["groups"] < 50
+    assert stats["avg_group_size"] > 1
+
+
+@pytest.mark.anyio
+async def test_group_commit_failed_write_only_fails_itself(group_commit_database: RoutedDatabase):
+    results = await asyncio.gather(
+        group_commit_database.execute("INSERT INTO posts (body) VALUES ('Post')"),
+        group_commit_database.execute("INSERT INTO posts (body) VALUES (NULL)"),
+        group_commit_database.execute("INSERT INTO posts (body) VALUES ('Post')"),
+        return_exceptions=True,
+    )
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert await group_commit_database.fetch_val("SELECT count(*) FROM posts") == 2
+
+
+@pytest.mark.anyio
+async def test_group_commit_with_transactions(group_commit_database: RoutedDatabase):
+    async def transaction():
+        async with group_commit_database.transaction():
+            await group_commit_database.execute("INSERT INTO posts (body) VALUES ('In a transaction')")
+
+    await asyncio.gather(
+        *[group_commit_database.execute("INSERT INTO posts (body) VALUES ('Post')") for _ in range(10)],
+        transaction(),
+        *[group_commit_database.execute("INSERT INTO posts (body) VALUES ('Post')") for _ in range(10)],
+    )
+    assert await group_commit_database.fetch_val("SELECT count(*) FROM posts") == 21
+
+
+@pytest.mark.anyio
+async def test_iterate_does_not_hold_a_pool_connection(routed_database: RoutedDatabase):
+    await routed_database.execute("INSERT INTO posts (body) VALUES ('Post')")
+    # More slow iterators than there are pool connections, and reads still go through
+    iterators = [routed_database.iterate("SELECT * FROM posts") for _ in range(3)]
+    for iterator in iterators:
+        await iterator.__anext__()
+    assert routed_database.stats()["read_pool"]["dedicated"] == 3
+    assert routed_database.stats()["read_pool"]["available"] == 2
+    assert await asyncio.wait_for(routed_database.fetch_val("SELECT count(*) FROM posts"), timeout=1) == 1
+    for iterator in iterators:
+        await iterator.aclose()
+    assert routed_database.stats()["read_pool"]["dedicated"] == 0
+
+
+@pytest.mark.anyio
+async def test_group_commit_transaction_rolled_back(group_commit_database: RoutedDatabase):
+    # ON CONFLICT ROLLBACK makes SQLite roll back the whole transaction, not just the statement that failed
+    await group_commit_database.execute("CREATE TABLE tags (name TEXT UNIQUE ON CONFLICT ROLLBACK)")
+    await group_commit_database.execute("INSERT INTO tags (name) VALUES ('taken')")
+    results = await asyncio.gather(
+        group_commit_database.execute("INSERT INTO tags (name) VALUES ('before')"),
+        group_commit_database.execute("INSERT INTO tags (name) VALUES ('taken')"),
+        group_commit_database.execute("INSERT INTO tags (name) VALUES ('after')"),
+        return_exceptions=True,
+    )
+    assert group_commit_database.stats()["writer"]["groups"] == 1
+    # 'before' was rolled back with the transaction, so it must not report success
+    assert isinstance(results[0], sqlite3.IntegrityError)
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert not isinstance(results[2], Exception)
+    rows = await group_commit_database.fetch_all("SELECT name FROM tags ORDER BY rowid")
+    assert [row[0] for row in rows] == ["taken", "after"]
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import pytest
+
+from storeapi.executor import BoundedExecutor
+
+
+@pytest.mark.anyio
+async def test_run_returns_result():
+    executor = BoundedExecutor("test", max_workers=2)
+    assert await executor.run(pow, 2, 10) == 1024
+    assert executor.stats()["completed"] == 1
+    executor.shutdown()
+
+
+@pytest.mark.anyio
+async def test_calls_over_max_workers_are_queued():
+    executor = BoundedExecutor("test", max_workers=2)
+    release = threading.Event()
+    calls = [asyncio.create_task(executor.run(release.wait)) for _ in range(5)]
+    await asyncio.sleep(0.05)
+    assert executor.stats()["active"] == 2
+    assert executor.stats()["queued"] == 3
+    release.set()
+    await asyncio.gather(*calls)
+    assert executor.stats()["max_queued"] == 3
+    assert executor.stats()["active"] == 0
+    executor.shutdown()
+
+
+@pytest.mark.anyio
+async def test_failures_are_counted():
+    executor = BoundedExecutor("test", max_workers=1)
+    with pytest.raises(ZeroDivisionError):
+        await executor.run(divmod, 1, 0)
+    assert executor.stats()["failed"] == 1
+    executor.shutdown()
+
+
+@pytest.mark.anyio
+async def test_timeout_keeps_slot_until_call_returns():
+    executor = BoundedExecutor("test", max_workers=1)
+    release = threading.Event()
+    with pytest.raises(TimeoutError):
+        await executor.run(release.wait, timeout=0.05)
+    assert executor.stats()["timed_out"] == 1
+    # The thread is still running, so the next call has to wait for it
+    assert executor.stats()["active"] == 1
+    call = asyncio.create_task(executor.run(pow, 2, 10))
+    await asyncio.sleep(0.05)
+    assert executor.stats()["queued"] == 1
+    release.set()
+    assert await call == 1024
+    assert executor.stats()["active"] == 0
+    executor.shutdown()
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from storeapi.like_buffer import LikeBuffer
+
+
+class FakeWriter:
+    def __init__(self, fail_post_id: int | None = None):
+        self.batches = []
+        self.fail_post_id = fail_post_id
+
+    async def __call__(self, likes: list[dict]):
+        if any(like["post_id"] == self.fail_post_id for like in likes):
+            raise ValueError("Post not found")
+        self.batches.append([like["post_id"] for like in likes])
+
+
+@pytest.mark.anyio
+async def test_flush_writes_in_batches_of_max_size():
+    writer = FakeWriter()
+    buffer = LikeBuffer(writer, max_size=2, max_delay=60)
+    for post_id in range(5):
+        buffer.add({"post_id": post_id, "user_id": 1})
+    await buffer.flush()
+    assert writer.batches == [[0, 1], [2, 3], [4]]
+    assert buffer.stats()["pending"] == 0
+    assert buffer.stats()["written"] == 5
+
+
+@pytest.mark.anyio
+async def test_background_flush_when_full():
+    writer = FakeWriter()
+    buffer = LikeBuffer(writer, max_size=2, max_delay=60)
+    buffer.start()
+    buffer.add({"post_id": 1, "user_id": 1})
+    buffer.add({"post_id": 2, "user_id": 1})
+    await asyncio.sleep(0.01)
+    assert writer.batches == [[1, 2]]
+    await buffer.stop()
+
+
+@pytest.mark.anyio
+async def test_background_flush_after_max_delay():
+    writer = FakeWriter()
+    buffer = LikeBuffer(writer, max_size=100, max_delay=0.01)
+    buffer.start()
+    buffer.add({"post_id": 1, "user_id": 1})
+    await asyncio.sleep(0.05)
+    assert writer.batches == [[1]]
+    await buffer.stop()
+
+
+@pytest.mark.anyio
+async def test_stop_drains_pending_likes():
+    writer = FakeWriter()
+    buffer = LikeBuffer(writer, max_size=100, max_delay=60)
+    buffer.start()
+    buffer.add({"post_id": 1, "user_id": 1})
+    await buffer.stop()
+    assert writer.batches == [[1]]
+
+
+class SlowWriter(FakeWriter):
+    async def __call__(self, likes: list[dict]):
+        await asyncio.sleep(0.2)
+        await super().__call__(likes)
+
+
+@pytest.mark.anyio
+async def test_stop_during_write_keeps_the_batch():
+    writer = SlowWriter()
+    buffer = LikeBuffer(writer, max_size=2, max_delay=60)
+    buffer.start()
+    buffer.add({"post_id": 1, "user_id": 1})
+    buffer.add({"post_id": 2, "user_id": 1})
+    await asyncio.sleep(0.05)  # The background task is now writing the batch
+    await buffer.stop()
+    assert writer.batches == [[1, 2]]
+    assert buffer.stats()["written"] == 2
+    assert buffer.stats()["pending"] == 0
+
+
+@pytest.mark.anyio
+async def test_failed_batch_is_retried_one_at_a_time():
+    writer = FakeWriter(fail_post_id=2)
+    buffer = LikeBuffer(writer, max_size=100, max_delay=60)
+    for post_id in (1, 2, 3):
+        buffer.add({"post_id": post_id, "user_id": 1})
+    await buffer.flush()
+    assert writer.batches == [[1], [3]]
+    assert buffer.stats()["failed"] == 1
@@ -0,0 +1,54 @@
+from storeapi.ranking import PostRanking
+
+
+def make_post(post_id: int, likes: int) -> dict:
+    return {"id": post_id, "body": f"Post {post_id}", "user_id": 1, "image_url": None, "likes": likes}
+
+
+def post_ids(posts: list[dict]) -> list[int]:
+    return [post["id"] for post in posts]
+
+
+def test_page_cold_index():
+    assert PostRanking(capacity=10).page(limit=5) is None
+
+
+def test_page_orders_by_likes_then_newest():
+    ranking = PostRanking(capacity=10)
+    ranking.load([make_post(3, 5), make_post(2, 1), make_post(1, 1)])
+    assert post_ids(ranking.page(limit=5)) == [3, 2, 1]
+    assert post_ids(ranking.page(limit=5, after=make_post(3, 5))) == [2, 1]
+
+
+def test_upsert_moves_post_up():
+    ranking = PostRanking(capacity=10)
+    ranking.load([make_post(2, 1), make_post(1, 0)])
+    ranking.upsert(make_post(1, 2))
+    ranking.upsert(make_post(3, 0))
+    assert post_ids(ranking.page(limit=5)) == [1, 2, 3]
+
+
+def test_upsert_ignores_stale_update():
+    ranking = PostRanking(capacity=10)
+    ranking.load([make_post(1, 3)])
+    ranking.upsert(make_post(1, 2))
+    assert ranking.page(limit=5)[0]["likes"] == 3
+
+
+def test_page_past_end_of_incomplete_index():
+    ranking = PostRanking(capacity=2)
+    # Three rows means there are more posts in the database than fit in the index
+    ranking.load([make_post(3, 3), make_post(2, 2), make_post(1, 1)])
+    assert post_ids(ranking.page(limit=1)) == [3, 2]
+    assert ranking.page(limit=2) is None
+
+
+def test_upsert_evicts_lowest_ranked_post():
+    ranking = PostRanking(capacity=2)
+    ranking.load([make_post(2, 2), make_post(1, 1)])
+    assert ranking.complete
+    ranking.upsert(make_post(3, 0))
+    assert not ranking.complete
+    ranking.upsert(make_post(1, 3))
+    assert post_ids(ranking.page(limit=1)) == [1, 2]
+    assert ranking.page(limit=2) is None
@@ -0,0 +1,45 @@
+from storeapi.rate_limit import TokenBucketLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_burst_then_rate():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rate=1, burst=3, max_keys=10, clock=clock)
+    assert [limiter.acquire("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("a") == 1
+    clock.now = 1
+    assert limiter.acquire("a") == 0
+    assert limiter.stats()["limited"] == 1
+
+
+def test_keys_are_limited_separately():
+    limiter = TokenBucketLimiter(rate=1, burst=1, max_keys=10, clock=FakeClock())
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("b") == 0
+    assert limiter.acquire("a") > 0
+
+
+def test_idle_keys_expire():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rate=1, burst=2, max_keys=10, clock=clock)
+    limiter.acquire("a")
+    clock.now = 1
+    limiter.acquire("b")
+    clock.now = 2.5
+    limiter.acquire("c")
+    # "a" has been idle long enough to refill completely, "b" hasn't
+    assert len(limiter) == 2
+
+
+def test_max_keys():
+    limiter = TokenBucketLimiter(rate=1, burst=1, max_keys=2, clock=FakeClock())
+    for key in "abc":
+        limiter.acquire(key)
+    assert len(limiter) == 2
@@ -1,8 +1,10 @@
 import pytest
 
 from jose import jwt
+from passlib.context import CryptContext
 
 from storeapi import security
+from storeapi.database import database, user_table
 
 
 def test_access_token_expire_minutes():
@@ -76,6 +78,23 @@ def test_get_subject_for_token_type_wrong_type():
         assert "Token has incorrect type, expected 'access'" == exc_info.value.detail
 
 
+def test_verified_token_is_cached(mocker):
+    token = security.create_access_token("test@example.com")
+    security.get_subject_for_token_type(token, "access")
+    decode = mocker.spy(security.jwt, "decode")
+    assert "test@example.com" == security.get_subject_for_token_type(token, "access")
+    decode.assert_not_called()
+
+
+def test_expired_token_is_not_served_from_cache(mocker):
+    token = security.create_access_token("test@example.com")
+    security.get_subject_for_token_type(token, "access")
+    mocker.patch("storeapi.security.time.time", return_value=security.time.time() + 31 * 60)
+    decode = mocker.spy(security.jwt, "decode")
+    security.get_subject_for_token_type(token, "access")
+    decode.assert_called_once()
+
+
 def test_password_hashes():
     password = "password"
     assert security.verify_password(password, security.get_password_hash(password))
@@ -87,6 +106,25 @@ async def test_get_user(registered_user: dict):
     assert user.email == registered_user["email"]
 
 
+@pytest.mark.anyio
+async def test_get_user_is_cached(registered_user: dict, mocker):
+    await security.get_user(registered_user["email"])
+    fetch_one = mocker.spy(security.database, "fetch_one")
+    user = await security.get_user(registered_user["email"])
+    assert user.email == registered_user["email"]
+    fetch_one.assert_not_called()
+    assert security.user_cache.stats()["hits"] >= 1
+
+
+@pytest.mark.anyio
+async def test_invalidate_user(registered_user: dict, mocker):
+    await security.get_user(registered_user["email"])
+    security.invalidate_user(registered_user["email"])
+    fetch_one = mocker.spy(security.database, "fetch_one")
+    await security.get_user(registered_user["email"])
+    fetch_one.assert_called_once()
+
+
 @pytest.mark.anyio
 async def test_get_user_not_found():
     user = await security.get_user("test@example.com")
@@ -101,6 +139,63 @@ async def test_authenticated_user(confirmed_user: dict):
     assert user.email == confirmed_user["email"]
 
 
+@pytest.mark.anyio
+async def test_authenticated_user_rehashes_outdated_password(confirmed_user: dict, mocker):
+    mocker.patch.object(security, "pwd_context", CryptContext(schemes=["bcrypt"]))
+    password = security.pwd_context.handler("bcrypt").using(rounds=4).hash(confirmed_user["password"])
+    await database.execute(
+        user_table.update().where(user_table.c.email == confirmed_user["email"]).values(password=password)
+    )
+    security.invalidate_user(confirmed_user["email"])
+    security.configure_bcrypt_rounds(5)
+    await security.authenticate_user(confirmed_user["email"], confirmed_user["password"])
+    user = await security.get_user(confirmed_user["email"])
+    assert user.password.startswith("$2b$05$")
+    assert not security.pwd_context.needs_update(user.password)
+    await security.authenticate_user(confirmed_user["email"], confirmed_user["password"])
+
+
+def test_configure_bcrypt_rounds_never_lowers_the_cost(mocker):
+    mocker.patch.object(security, "pwd_context", CryptContext(schemes=["bcrypt"]))
+    security.configure_bcrypt_rounds(6)
+    bcrypt = security.pwd_context.handler("bcrypt")
+    assert security.pwd_context.needs_update(bcrypt.using(rounds=5).hash("password"))
+    assert not security.pwd_context.needs_update(bcrypt.using(rounds=7).hash("password"))
+
+
+def fake_clock(*hash_seconds: float):
+    # A clock for calibrate_bcrypt_rounds under which the hashes it times take hash_seconds, one after the other
+    readings = []
+    for i, seconds in enumerate(hash_seconds):
+        readings += [i * 10.0, i * 10.0 + seconds]
+    return iter(readings).__next__
+
+
+def test_calibrate_bcrypt_rounds():
+    # Timed at 4 rounds, each round doubles the time: 0.001 s * 2 ** 3 = 0.008 s
+    assert security.calibrate_bcrypt_rounds(0.008, 4, 31, clock=fake_clock(0.001, 0.001, 0.001)) == 7
+    # The fastest of the three counts
+    assert security.calibrate_bcrypt_rounds(0.008, 4, 31, clock=fake_clock(0.004, 0.001, 0.002)) == 7
+    assert security.calibrate_bcrypt_rounds(0.001, 5, 31, clock=fake_clock(0.001, 0.001, 0.001)) == 5
+    assert security.calibrate_bcrypt_rounds(1000, 4, 12, clock=fake_clock(0.001, 0.001, 0.001)) == 12
+
+
+def test_calibrate_bcrypt_rounds_warns_when_the_minimum_is_over_target(mocker):
+    warning = mocker.spy(security.logger, "warning")
+    assert security.calibrate_bcrypt_rounds(0.0001, 5, 31, clock=fake_clock(0.001, 0.001, 0.001)) == 5
+    assert "more than the 0.0001s target" in warning.call_args.args[0]
+    warning.reset_mock()
+    assert security.calibrate_bcrypt_rounds(0.008, 4, 31, clock=fake_clock(0.001, 0.001, 0.001)) == 7
+    warning.assert_not_called()
+
+
+def test_calibrate_bcrypt_rounds_above_calibration_rounds():
+    # Timed at CALIBRATION_ROUNDS and scaled up to the cost of more rounds
+    min_rounds = security.CALIBRATION_ROUNDS + 2
+    rounds = security.calibrate_bcrypt_rounds(0.256, min_rounds, 31, clock=fake_clock(0.001, 0.001, 0.001))
+    assert rounds == security.CALIBRATION_ROUNDS + 8
+
+
 @pytest.mark.anyio
 async def test_authenticated_user_not_found():
     with pytest.raises(security.HTTPException):
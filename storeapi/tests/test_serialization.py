@@ -0,0 +1,32 @@
+from pydantic import TypeAdapter
+
+from storeapi.main import app
+from storeapi.models.post import Comment, UserPostWithLikes
+from storeapi.serialization import dump_json, rows_to_dicts
+
+
+def test_rows_match_response_model_output():
+    rows = [
+        {"id": 1, "body": "Test Post", "user_id": 1, "image_url": None, "likes": 2, "like_count": 2},
+        {"id": 2, "body": "Test Post 2", "user_id": 1, "image_url": "https://fakeurl.com", "likes": 0},
+    ]
+    adapter = TypeAdapter(list[UserPostWithLikes])
+    assert dump_json(rows_to_dicts(rows, UserPostWithLikes)) == adapter.dump_json(adapter.validate_python(rows))
+
+
+def test_comment_rows_match_response_model_output():
+    rows = [{"id": 1, "body": "Test Comment", "post_id": 1, "user_id": 1}]
+    adapter = TypeAdapter(list[Comment])
+    assert dump_json(rows_to_dicts(rows, Comment)) == adapter.dump_json(adapter.validate_python(rows))
+
+
+def test_openapi_keeps_response_models():
+    paths = app.openapi()["paths"]
+
+    def response_schema(path: str) -> dict:
+        return paths[path]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+
+    assert response_schema("/post") == {"$ref": "#/components/schemas/UserPostPage"}
+    assert response_schema("/post/search") == {"$ref": "#/components/schemas/UserPostPage"}
+    assert response_schema("/post/{post_id}") == {"$ref": "#/components/schemas/UserPostWithComments"}
+    assert response_schema("/post/{post_id}/comment")["items"] == {"$ref": "#/components/schemas/Comment"}
@@ -0,0 +1,34 @@
+import pytest
+import sqlalchemy
+
+from storeapi.database import database, post_table
+from storeapi.routers import post as post_router
+from storeapi.statements import Statement
+
+
+@pytest.mark.anyio
+async def test_statement_compiles_once(registered_user: dict):
+    insert = Statement(post_table.insert(), column_keys=["body", "user_id"])
+    select = Statement(post_table.select().where(post_table.c.id == sqlalchemy.bindparam("post_id")))
+    ids = [await database.execute(insert(body=f"Post {i}", user_id=registered_user["id"])) for i in range(3)]
+    for i, post_id in enumerate(ids):
+        post = await database.fetch_one(select(post_id=post_id))
+        assert post.body == f"Post {i}"
+    assert insert.compilations == 1
+    assert select.compilations == 1
+
+
+def test_statement_sql_uses_named_parameters():
+    insert = Statement(post_table.insert(), column_keys=["body", "user_id"])
+    assert str(insert) == "INSERT INTO posts (body, user_id) VALUES (:body, :user_id)"
+
+
+@pytest.mark.anyio
+async def test_feed_statements_are_reused(async_client, registered_user: dict):
+    post_id = await database.execute(post_router.insert_post_statement(body="Test Post", user_id=registered_user["id"]))
+    statement = post_router.feed_statements[(post_router.PostSorting.old, False)]
+    compilations = statement.compilations
+    for limit in (1, 2, 3):
+        response = await async_client.get("/post", params={"sorting": "old", "limit": limit})
+        assert response.json()["posts"][0]["id"] == post_id
+    assert statement.compilations == max(compilations, 1)